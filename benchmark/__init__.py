@@ -0,0 +1,9 @@
+"""Benchmark Package for the CCL Tool
+
+Rev: A
+
+Generates synthetic AVL multilevel boms and CCL docx files, then times the main steps of the
+tool. Run with python -m benchmark.run, see benchmark/run.py for the options.
+"""
+
+from benchmark.generate import generate_bom, revise_bom, generate_ccl
@@ -0,0 +1,124 @@
+"""Synthetic data for the benchmarks
+
+Rev: A
+
+Boms follow the AVL multilevel bom export, columns Level, F/N, Name, Description, Manufacturer and
+Equivalent. The CCL follows the 2020 TRF table (see package.Parser), one row per critical part.
+"""
+
+import random
+
+import pandas as pd
+from docx import Document
+
+COLUMNS = ['Level', 'F/N', 'Name', 'Description', 'Manufacturer', 'Equivalent']
+TYPES = ['CABLE', 'PCB', 'SCREW', 'LABEL', 'ASSY', 'FAN', 'PSU', 'WIRE', 'FUSE', 'RELAY']
+DETAILS = ['RED', 'BLUE', '20A', 'M3 X 6', 'SHIELDED', '24V', '120MM', 'UL94-V0']
+VENDORS = ['AB Sciex', 'Molex', 'TE Connectivity', 'Delta', 'Littelfuse', 'Omron']
+PN_START = 1000000
+
+
+def generate_bom(size: int = 2000, depth: int = 6, seed: int = 0):
+    """Random AVL multilevel bom
+
+    Part numbers are reused so the same sub assembly can show up under different parents,
+    like in a real bom.
+
+    Parameters:
+        :param size: number of rows including the top level
+        :param depth: deepest level
+        :param seed: random seed, same seed gives the same bom
+
+    :return: dataframe with the AVL bom columns
+    """
+    rand = random.Random(seed)
+    rows = [[0, None, 'TOP', 'PRODUCT*TOP', 'AB Sciex\n', 'TOP\n']]
+    level = 0
+    for _ in range(size - 1):
+        # A child is at most one level below the row above it
+        level = rand.randint(1, min(level + 1, depth)) if level else 1
+        rows.append([level, rand.randint(1, 40), str(rand.randint(PN_START, PN_START + size // 2)),
+                     _description(rand), _manufacturer(rand), _equivalent(rand)])
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def revise_bom(bom: pd.DataFrame, churn: float = 0.05, seed: int = 0):
+    """New revision of a bom with part changes
+
+    Parameters:
+        :param bom: bom from generate_bom
+        :param churn: chance of each row being replaced by a new part number with a similar description,
+            F/N changes, removed rows, new parts and added rows are a fraction of it
+        :param seed: random seed
+
+    :return: the revised bom as a new dataframe
+    """
+    rand = random.Random(seed)
+    rows = bom[COLUMNS].values.tolist()
+    revised = [list(rows[0])]
+    for idx in range(1, len(rows)):
+        row = list(rows[idx])
+        chance = rand.random()
+        if chance < churn:
+            # Replaced part, the description is close to the old one
+            row[2] = str(int(row[2]) + 7 * PN_START)
+            row[3] = row[3] + ' REV'
+        elif chance < churn * 1.5:
+            row[1] = row[1] + 1
+        elif chance < churn * 1.8:
+            # Only remove parts without children so the levels stay valid
+            if idx + 1 == len(rows) or rows[idx + 1][0] <= row[0]:
+                continue
+        elif chance < churn * 2:
+            row[2] = str(9 * PN_START + rand.randint(0, 99999))
+            row[3] = f'NEWPART*{rand.choice(DETAILS)} {rand.randint(1, 999)}'
+        revised.append(row)
+        if rand.random() < churn * 0.3:
+            revised.append([row[0], rand.randint(1, 40), str(8 * PN_START + rand.randint(0, 9999)),
+                            _description(rand), _manufacturer(rand), _equivalent(rand)])
+    return pd.DataFrame(revised, columns=COLUMNS)
+
+
+def generate_ccl(path: str, bom: pd.DataFrame, rows: int = 200, seed: int = 0):
+    """CCL docx with parts taken from the bom
+
+    Parameters:
+        :param path: save path of the docx
+        :param bom: bom the critical parts are picked from
+        :param rows: number of table rows, limited by the unique part numbers of the bom
+        :param seed: random seed
+    """
+    rand = random.Random(seed)
+    parts = bom[bom['Level'] > 0].drop_duplicates('Name')
+    parts = parts.sample(n=min(rows, len(parts.index)), random_state=seed).sort_index()
+    document = Document()
+    document.add_paragraph('Critical Components List')
+    table = document.add_table(rows=len(parts.index), cols=7)
+    for row, (idx, part) in enumerate(parts.iterrows()):
+        technical = rand.choice([
+            '',
+            f'Refer to Ill. {row + 1} Assy. D{rand.randint(100000, 999999)}',
+            f'Refer to Ill. {row + 1} Sch. D{rand.randint(100000, 999999)}',
+            f'D{rand.randint(100000, 999999)}',
+        ])
+        values = [part['Name'], f'{part["Description"]} (#{int(part["F/N"])})',
+                  part['Manufacturer'].split('\n')[0], part['Equivalent'].split('\n')[0],
+                  technical, 'UL 60950-1', 'UL, CSA']
+        for column, value in enumerate(values):
+            run = table.rows[row].cells[column].paragraphs[0].add_run(value)
+            # Bold rows are the cable headings of the TRF
+            if part['Level'] == 1:
+                run.bold = True
+    document.save(path)
+
+
+def _description(rand):
+    return f'{rand.choice(TYPES)}*{rand.choice(DETAILS)} {rand.randint(1, 99)}'
+
+
+def _manufacturer(rand):
+    return ''.join(vendor + '\n' for vendor in rand.sample(VENDORS, rand.randint(1, 2)))
+
+
+def _equivalent(rand):
+    return ''.join(f'MDL-{rand.randint(100, 999)}\n' for _ in range(rand.randint(1, 2)))
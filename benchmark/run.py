@@ -0,0 +1,201 @@
+"""Benchmark runner
+
+Rev: A
+
+Times Parent.build_tree, Parser.filter, CCL.bom_compare, CCL.update_ccl and CCL.save_compare on
+generated data and saves the timings as json. bom_compare is run with every matching mode and also
+saves the match counts so the modes can be compared. The greedy bom_compare is also run with worker
+processes, its result has the speedup over the single process run.
+
+Usage:
+    python -m benchmark.run --sizes 500 2000 --out results.json
+    python -m benchmark.run --baseline old.json --out new.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# Run from the repo root, the tool modules are top level
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from benchmark.generate import generate_bom, revise_bom, generate_ccl
+from package import Parent, Parser
+from ccl import CCL, match_counts
+from compare import MATCHING
+
+# Increase when the stages or the generated data change, results of different versions should not be compared
+BENCHMARK_VERSION = 3
+
+
+def timed(function, repeat: int):
+    """Calls function repeat times with its prints hidden
+
+    :return: list of seconds per call, return value of the last call
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            returned = function()
+            times.append(time.perf_counter() - start)
+    return times, returned
+
+
+def uncached(ccl: CCL, function):
+    """Calls function after clearing the trees and result kept by ccl, so every call does the full compare"""
+
+    ccl.clear_compare()
+    return function()
+
+
+def bom_compare(ccl: CCL, matching: str, processes: int = 1):
+    ccl.matching, ccl.processes = matching, processes
+    ccl.clear_compare()
+    try:
+        return ccl.bom_compare()
+    finally:
+        ccl.matching, ccl.processes = 'greedy', 1
+
+
+def run_size(folder: str, size: int, depth: int, churn: float, ccl_rows: int, seed: int, repeat: int,
+             processes: int = 2):
+    """Benchmarks every stage for one bom size
+
+    :return: list of result dicts, one per stage and variant
+    """
+    bom = generate_bom(size, depth, seed)
+    bom_updated = revise_bom(bom, churn, seed)
+    old_path = os.path.join(folder, f'old {size}.csv')
+    new_path = os.path.join(folder, f'new {size}.csv')
+    ccl_path = os.path.join(folder, f'ccl {size}.docx')
+    bom.to_csv(old_path, index=False)
+    bom_updated.to_csv(new_path, index=False)
+    generate_ccl(ccl_path, bom, ccl_rows, seed)
+
+    ccl = CCL()
+    ccl.cache = False
+    ccl.set_bom_compare(old_path, new_path)
+    ccl.ccl_docx = ccl_path
+    stages = []
+    for builder in Parent.BUILDERS:
+        stages.append(('build_tree', builder, lambda builder=builder: Parent(bom, builder).build_tree()))
+    for fast in (False, True):
+        stages.append(('filter', 'fast' if fast else 'docx',
+                       lambda fast=fast: Parser(ccl_path, fast=fast, cache=False).filter()))
+    for matching in MATCHING:
+        stages.append(('bom_compare', matching, lambda matching=matching: bom_compare(ccl, matching)))
+    stages.append(('bom_compare', 'parallel', lambda: bom_compare(ccl, 'greedy', processes)))
+    # update_ccl and save_compare include their own bom_compare
+    stages.append(('update_ccl', 'default',
+                   lambda: uncached(ccl, lambda: ccl.update_ccl(os.path.join(folder, 'updated.docx')))))
+    stages.append(('save_compare', 'default',
+                   lambda: uncached(ccl, lambda: ccl.save_compare(os.path.join(folder, 'compare.zip')))))
+
+    results = []
+    for stage, variant, function in stages:
+        times, returned = timed(function, repeat)
+        results.append({
+            'stage': stage, 'variant': variant, 'size': size, 'size_updated': len(bom_updated.index),
+            'depth': depth, 'churn': churn, 'times': times, 'min': min(times), 'mean': sum(times) / len(times),
+        })
+        if stage == 'bom_compare':
+            results[-1]['counts'] = match_counts(*returned)
+        if variant == 'parallel':
+            single = next(result['min'] for result in results if result['variant'] == 'greedy')
+            results[-1]['processes'] = processes
+            results[-1]['speedup'] = single / results[-1]['min']
+    return results
+
+
+def environment():
+    """Versions and machine info saved with the results"""
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(), 'commit': commit}
+
+
+def run(sizes=(500, 2000), depth: int = 6, churn: float = 0.05, ccl_rows: int = 200, seed: int = 0, repeat: int = 3,
+        processes: int = 2):
+    """Runs the benchmarks for every size
+
+    :return: dict with the version, environment, parameters and results, can be saved as json
+    """
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        # save_compare makes its temporary folder in the working directory
+        os.chdir(folder)
+        try:
+            for size in sizes:
+                results.extend(run_size(folder, size, depth, churn, ccl_rows, seed, repeat, processes))
+        finally:
+            os.chdir(cwd)
+    return {
+        'version': BENCHMARK_VERSION,
+        'environment': environment(),
+        'parameters': {'sizes': list(sizes), 'depth': depth, 'churn': churn, 'ccl_rows': ccl_rows,
+                       'seed': seed, 'repeat': repeat, 'processes': processes},
+        'results': results,
+    }
+
+
+def compare_results(baseline: dict, current: dict):
+    """Ratio of current to baseline min time for every stage found in both
+
+    :return: list of (stage, variant, size, baseline min, current min, ratio)
+    """
+    if baseline.get('version') != current.get('version'):
+        raise ValueError('Benchmark versions differ, results can not be compared')
+    old = {(result['stage'], result['variant'], result['size']): result['min'] for result in baseline['results']}
+    compared = []
+    for result in current['results']:
+        key = (result['stage'], result['variant'], result['size'])
+        if key in old:
+            compared.append(key + (old[key], result['min'], result['min'] / old[key] if old[key] else float('inf')))
+    return compared
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the CCL Tool on generated boms and CCLs')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[500, 2000], help='bom rows')
+    parser.add_argument('--depth', type=int, default=6, help='deepest bom level')
+    parser.add_argument('--churn', type=float, default=0.05, help='chance of a part changing between revisions')
+    parser.add_argument('--ccl-rows', type=int, default=200, help='rows in the generated CCL')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per stage, the min is reported')
+    parser.add_argument('--processes', type=int, default=2, help='workers for the parallel bom_compare')
+    parser.add_argument('--out', help='json file for the results, printed if not given')
+    parser.add_argument('--baseline', help='json results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.depth, args.churn, args.ccl_rows, args.seed, args.repeat, args.processes)
+    if args.out:
+        with open(args.out, 'w') as write:
+            json.dump(results, write, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline, 'r') as read:
+            baseline = json.load(read)
+        for stage, variant, size, old, new, ratio in compare_results(baseline, results):
+            print(f'{stage:<14}{variant:<10}{size:>8}{old:>10.4f}s{new:>10.4f}s{ratio:>8.2f}x', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Cache Module for results that are expensive to recompute
+
+Rev: A
+
+Entries are saved as pickles in a cache folder and keyed by content hashes, so
+a changed input file never reuses an old entry.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.ccl_tool', 'cache')
+MAX_BYTES = 512 * 1024 * 1024
+
+_default = None
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20):
+    """Sha256 of the file contents as a hex string"""
+
+    sha = hashlib.sha256()
+    with open(path, 'rb') as read:
+        for chunk in iter(lambda: read.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def default_cache():
+    """The shared cache used when no cache is given, created on first use"""
+
+    global _default
+    if _default is None:
+        _default = DiskCache()
+    return _default
+
+
+class DiskCache:
+    """Size bounded cache saved on disk
+
+    Every entry is one pickle file named after its key. Reading an entry updates its
+    modified time, when the folder is over max_bytes the least recently used entries
+    are removed first.
+
+    Attributes:
+        path (str): folder where the entries are saved
+        max_bytes (int): maximum total size of all entries
+    """
+    EXTENSION = '.pkl'
+
+    def __init__(self, path: str = CACHE_DIR, max_bytes: int = MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _file(self, key: str):
+        """File path of the entry, the key is hashed so any string can be used"""
+
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, name + self.EXTENSION)
+
+    def get(self, key: str, default=None):
+        """Returns the cached value or default if not found
+
+        An entry that can not be read, such as one pickled with classes that have since changed,
+        is removed and default is returned.
+        """
+        file = self._file(key)
+        try:
+            with open(file, 'rb') as read:
+                value = pickle.load(read)
+            os.utime(file)
+        except FileNotFoundError:
+            return default
+        except Exception:
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            return default
+        return value
+
+    def put(self, key: str, value):
+        """Saves value under key then evicts old entries if over the size limit
+
+        Saving is best effort, if the cache folder can not be written to the value is not saved.
+        """
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # Write to a temporary file first so a partly written entry is never read
+            handle, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(handle, 'wb') as write:
+                pickle.dump(value, write, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, self._file(key))
+        except Exception as e:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+            if isinstance(e, OSError):
+                return
+            raise e
+        self.evict()
+
+    def __contains__(self, key: str):
+        return os.path.exists(self._file(key))
+
+    def _entries(self):
+        """All entries as (modified time, size, path)"""
+
+        entries = []
+        try:
+            files = os.listdir(self.path)
+        except OSError:
+            return entries
+        for file in files:
+            if file.endswith(self.EXTENSION):
+                # Another process can remove the entry at the same time
+                try:
+                    stat = os.stat(os.path.join(self.path, file))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(self.path, file)))
+        return entries
+
+    def size(self):
+        """Total size of all entries in bytes"""
+
+        return sum(size for mtime, size, file in self._entries())
+
+    def evict(self):
+        """Removes the least recently used entries until under max_bytes"""
+
+        entries = sorted(self._entries())
+        total = sum(size for mtime, size, file in entries)
+        for mtime, size, file in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Removes every entry"""
+
+        for mtime, size, file in self._entries():
+            os.remove(file)
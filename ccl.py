@@ -10,13 +10,76 @@ from docx.shared import RGBColor
 from docx.enum.text import WD_COLOR_INDEX
 from docx.shared import Pt
 
-from package import Parent, _re_doc_num, _re_pn
-from compare import Rearrange, Bom, Tracker
+from package import _re_doc_num, _re_pn
+from compare import Rearrange, BomSnapshot, Tracker, COMPARE_VERSION, THRESHOLD_FULL, THRESHOLD_PARTIAL, print_event
+from cache import default_cache, file_hash
 from filehandler import *
 
 import pandas as pd
 from docx.api import Document
 import shutil
+import tempfile
+import csv
+import sys
+import logging
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+# Column types of the AVL multilevel bom, other columns are left for pandas to infer. Level and F/N
+# are also inferred if they have values that are not numbers
+AVL_DTYPES = {'Level': 'int64', 'F/N': 'float64', 'Name': str, 'Description': str,
+              'Manufacturer': str, 'Equivalent': str}
+# Number of rows at the top of the AVL bom that are searched for the header
+AVL_HEADER_ROWS = 10
+# Lean mode, read only columns are stored as categories. Manufacturer and Equivalent are edited
+# by update_ccl so they are kept as interned strings instead
+AVL_CATEGORIES = ('Name', 'Description')
+AVL_INTERNED = ('Manufacturer', 'Equivalent')
+AVL_NUMBERS = ('Level', 'F/N')
+# Default threshold grid of CCL.threshold_sweep
+SWEEP_FULL = (30, 40, 50, 60, 70)
+SWEEP_PARTIAL = (60, 70, 80, 90)
+
+
+def compare_direction(snapshot_old: BomSnapshot, snapshot_new: BomSnapshot, matching: str, blocking: bool,
+                      event_level: int = None, thresholds: tuple = (THRESHOLD_FULL, THRESHOLD_PARTIAL)):
+    """Runs Rearrange for one direction of the bom compare, used by the worker processes of CCL.bom_compare
+
+    :param event_level: see Tracker.event_level, None to not make any events
+    :param thresholds: (threshold_full, threshold_partial) see compare.ismatch
+
+    :return: tracker, list of the compare events
+    """
+    tracker, events = Tracker(), []
+    if event_level is not None:
+        tracker.events, tracker.event_level = events.append, event_level
+    Rearrange(snapshot_old.bom(), snapshot_new.bom(), tracker, matching, blocking, thresholds=thresholds)
+    tracker.events = None
+    return tracker, events
+
+
+def match_counts(tracker: Tracker, tracker_reversed: Tracker):
+    """Number of full, partial and find only matches, removed and added parts of a bom compare"""
+
+    counts = tracker.combine_found()['match_type'].value_counts()
+    return {'full': int(counts.get('full', 0)), 'partial': int(counts.get('partial', 0)),
+            'fn_only': int(counts.get('fn_only', 0)), 'removed': len(tracker.not_found),
+            'added': len(tracker_reversed.not_found)}
+
+
+def sweep_thresholds(snapshot_old: BomSnapshot, snapshot_new: BomSnapshot, matching: str, blocking: bool,
+                     settings: list):
+    """Bom compare counts for every (threshold_full, threshold_partial) in settings, see CCL.threshold_sweep
+
+    :return: list of match_counts dicts with the thresholds added, in the order of settings
+    """
+    rows = []
+    for thresholds in settings:
+        tracker = compare_direction(snapshot_old, snapshot_new, matching, blocking, thresholds=thresholds)[0]
+        tracker_reversed = compare_direction(snapshot_new, snapshot_old, matching, blocking, thresholds=thresholds)[0]
+        rows.append({'threshold_full': thresholds[0], 'threshold_partial': thresholds[1],
+                     **match_counts(tracker, tracker_reversed)})
+    return rows
 
 
 class CCL:
@@ -37,6 +100,23 @@ class CCL:
         path_checks (str): paths to check before downloading form enovia
         username (str): Enovia username
         password (str): Enovia password
+        lean (bool): read avl boms with categorical, interned and small number columns
+        matching (str): greedy or assignment, how Rearrange picks updated parts see compare.Update
+        blocking (bool): only compare descriptions of the same type or with a shared word, faster but can
+            miss partial matches see compare.MatchMatrix
+        processes (int): number of workers, bom_compare runs both directions at the same time if more than 1
+        threshold_full (int): description match percentage for a full match, see compare.ismatch
+        threshold_partial (int): description match percentage for a partial match
+        events: sink given the compare events (see compare.Tracker), prints them by default, None for no events
+        event_level (int): logging level of the events given to events
+        revision_boms (dict): avl boms read by compare_revisions by filepath
+        cache (DiskCache): cache for bom_compare results, None for the default cache and False to not cache
+
+    Note:
+        The bom trees are built once per avl bom and kept as compare.BomSnapshot, each Rearrange run gets
+        its own copy. The last bom_compare result is kept until the avl boms or the compare settings change.
+        bom_compare results are also saved in the cache, keyed by the hashes of the avl bom files, so the
+        same compare is not run again by later calls or runs.
     """
     def __init__(self):
         # Files
@@ -55,49 +135,136 @@ class CCL:
         self.password = None
         # Parallel Computing
         self.processes = 1
+        # Memory
+        self.lean = False
+        # Bom comparison
+        self.matching = 'greedy'
+        self.blocking = False
+        self.threshold_full = THRESHOLD_FULL
+        self.threshold_partial = THRESHOLD_PARTIAL
+        self.events = print_event
+        self.event_level = logging.INFO
+        self.revision_boms = {}
+        self.cache = None
+        self._snapshots = {}
+        self._compared = None
+        self._avl_files = None
 
 ########################################################################################################################
 # Bom comparison
 ########################################################################################################################
 
-    def set_bom_compare(self, avl_bom_old: str, avl_bom_new: str):
+    def set_bom_compare(self, avl_bom_old: str, avl_bom_new: str, lean: bool = None):
         """Sets the bom vairables, convert file paths to df
 
         Parameters:
             :param avl_bom_old: filepath to the old avl multilevel bom
             :param avl_bom_new: filepath to the new avl multilevel bom
+            :param lean: same as the class lean, defaults to self.lean
         """
+        if lean is not None:
+            self.lean = lean
         # Set old
         self.avl_bom_path = avl_bom_old
         self.avl_bom_updated_path = avl_bom_new
         # Set new
-        self.avl_bom = CCL.read_avl(avl_bom_old, 0)
-        self.avl_bom_updated = CCL.read_avl(avl_bom_new, 0)
+        self.avl_bom = CCL.read_avl(avl_bom_old, lean=self.lean)
+        self.avl_bom_updated = CCL.read_avl(avl_bom_new, lean=self.lean)
+        self._avl_files = (self.avl_bom, self.avl_bom_updated)
 
     @staticmethod
-    def read_avl(path: str, skiprow: int):
+    def read_avl(path: str, skiprow: int = 0, lean: bool = False):
         """Read CSV and determine headers row
 
+        Note:
+            The header row is found by reading only the first rows of the file (see find_avl_header),
+            the csv is then parsed once using the AVL_DTYPES column types. A Level or F/N column with
+            values that are not numbers is read like the other columns.
+
         Parameters:
             :param path: path to the csv file
-            :param skiprow: recursive call to determine which row is header
+            :param skiprow: first row that could be the header
+            :param lean: shrink the dataframe with CCL.shrink_avl after reading
         """
-        df = pd.read_csv(path, skiprows=skiprow)
+        skiprow, header = CCL.find_avl_header(path, skiprow)
+        dtype = {column: AVL_DTYPES[column] for column in header if column in AVL_DTYPES}
         try:
-            df['Name']
-        except KeyError:
-            skiprow += 1
-            if skiprow < 10:
-                df = CCL.read_avl(path, skiprow)
-            else:
-                raise TypeError('File is in wrong format')
+            df = pd.read_csv(path, skiprows=skiprow, dtype=dtype)
+        except ValueError:
+            # Level can only be int if no rows are missing it
+            dtype['Level'] = 'float64'
+            try:
+                df = pd.read_csv(path, skiprows=skiprow, dtype=dtype)
+            except ValueError:
+                for column in AVL_NUMBERS:
+                    dtype.pop(column, None)
+                df = pd.read_csv(path, skiprows=skiprow, dtype=dtype)
+        if lean:
+            CCL.shrink_avl(df)
+        return df
+
+    @staticmethod
+    def shrink_avl(df: pd.DataFrame):
+        """Converts the avl bom columns to smaller dtypes in place
+
+        Note:
+            Name and Description become categories, Manufacturer and Equivalent are interned so the
+            same string is only stored once across both boms. Level and F/N are downcast to the
+            smallest int, or float32 when values are missing, unless they have values that are not numbers.
+
+        :return: the same dataframe
+        """
+        for column in AVL_CATEGORIES:
+            if column in df:
+                df[column] = df[column].astype('category')
+        for column in AVL_INTERNED:
+            if column in df:
+                df[column] = pd.Series(
+                    [sys.intern(value) if isinstance(value, str) else value for value in df[column]],
+                    index=df.index, dtype=object
+                )
+        for column in AVL_NUMBERS:
+            if column in df and pd.api.types.is_numeric_dtype(df[column]):
+                if df[column].isna().any():
+                    df[column] = df[column].astype('float32')
+                else:
+                    df[column] = pd.to_numeric(df[column], downcast='integer')
         return df
 
+    def bom_memory(self):
+        """Memory used by avl_bom and avl_bom_updated, including the strings
+
+        :return: dict of bytes per dataframe and the total
+        """
+        memory = {}
+        for name in ('avl_bom', 'avl_bom_updated'):
+            df = getattr(self, name)
+            memory[name] = 0 if df is None else int(df.memory_usage(deep=True).sum())
+        memory['total'] = sum(memory.values())
+        return memory
+
+    @staticmethod
+    def find_avl_header(path: str, skiprow: int = 0):
+        """Finds the header row, the first row with a Name column
+
+        Note:
+            Rows are counted by csv.reader the same way pandas counts skiprows, a quoted value can
+            span more than one line.
+
+        :return: number of rows to skip and the header columns
+        """
+        with open(path, newline='', encoding='utf-8-sig', errors='replace') as read:
+            for row, header in enumerate(islice(csv.reader(read), skiprow, AVL_HEADER_ROWS), skiprow):
+                if 'Name' in header:
+                    return row, header
+        raise TypeError('File is in wrong format')
+
     def avl_path_to_df(self):
         """Converts avl_bom_path to df if not given"""
 
-        self.avl_bom = pd.read_csv(self.avl_bom_path)
-        self.avl_bom_updated = pd.read_csv(self.avl_bom_updated_path)
+        self.avl_bom = CCL.read_avl(self.avl_bom_path, lean=self.lean)
+        self.avl_bom_updated = CCL.read_avl(self.avl_bom_updated_path, lean=self.lean)
+        self._avl_files = (self.avl_bom, self.avl_bom_updated)
 
     def bom_compare(self):
         """Performs a bom compare
@@ -109,25 +276,127 @@ class CCL:
         """
         if self.avl_bom is None or self.avl_bom_updated is None:
             raise ValueError('Missing required fields, ccl, avl_new or avl_old')
-        #  Create bom object for forward compare
-        tree, bom, tree_updated, bom_updated = self._get_bom_obj()
-        tracker = Tracker()
-        Rearrange(bom, bom_updated, tracker)
-        # Create new object because previous object was modified during rearraange process
-        tree, bom, tree_updated, bom_updated = self._get_bom_obj()
-        tracker_reversed = Tracker()
-        Rearrange(bom_updated, bom, tracker_reversed)
-        return tracker, tracker_reversed
-
-    def _get_bom_obj(self):
-        """Used to create bom object"""
-
-        tree = Parent(self.avl_bom).build_tree()
-        bom = Bom(self.avl_bom, tree)
-
-        tree_updated = Parent(self.avl_bom_updated).build_tree()
-        bom_updated = Bom(self.avl_bom_updated, tree_updated)
-        return tree, bom, tree_updated, bom_updated
+        settings = (self.matching, self.blocking, self.threshold_full, self.threshold_partial)
+        if self._compared is not None:
+            avl_bom, avl_bom_updated, compared_settings, result = self._compared
+            if avl_bom is self.avl_bom and avl_bom_updated is self.avl_bom_updated and compared_settings == settings:
+                return result
+        key = self._compare_key()
+        result = self._compare_cache().get(key) if key is not None else None
+        if result is None:
+            snapshot, snapshot_updated = self.bom_snapshot(self.avl_bom), self.bom_snapshot(self.avl_bom_updated)
+            result = tuple(self._run_compares([(snapshot, snapshot_updated), (snapshot_updated, snapshot)]))
+            if key is not None:
+                self._compare_cache().put(key, result)
+        self._compared = (self.avl_bom, self.avl_bom_updated, settings, result)
+        return result
+
+    def _compare_cache(self):
+        return default_cache() if self.cache is None else self.cache
+
+    def _compare_key(self):
+        """Cache key of bom_compare, None if not cached
+
+        The key has the hashes of both avl bom files, the ismatch thresholds, the compare settings and
+        COMPARE_VERSION. Only avl boms read from their files by set_bom_compare or avl_path_to_df are cached.
+        """
+        if self.cache is False or self._avl_files is None:
+            return None
+        if self._avl_files[0] is not self.avl_bom or self._avl_files[1] is not self.avl_bom_updated:
+            return None
+        paths = (self.avl_bom_path, self.avl_bom_updated_path)
+        if not all(isinstance(path, (str, os.PathLike)) for path in paths):
+            return None
+        hashes = ' '.join(file_hash(path) for path in paths)
+        return (f'bom_compare {COMPARE_VERSION} {hashes} {self.threshold_full} {self.threshold_partial} '
+                f'{self.matching} {self.blocking} {self.lean}')
+
+    def _run_compares(self, directions: list):
+        """Runs Rearrange for every (old snapshot, new snapshot), in worker processes if processes is more than 1
+
+        Note:
+            The runs do not share any state so the trackers are the same as running them one after the other.
+            With worker processes the events are given to events after all runs are done, in the order of
+            directions, so they are always the same.
+
+        :return: list of trackers in the same order as directions
+        """
+        trackers = []
+        event_level = None if self.events is None else self.event_level
+        thresholds = (self.threshold_full, self.threshold_partial)
+        if self.processes > 1 and len(directions) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(directions))) as executor:
+                futures = [executor.submit(compare_direction, old, new, self.matching, self.blocking, event_level,
+                                           thresholds)
+                           for old, new in directions]
+                results = [future.result() for future in futures]
+            for tracker, events in results:
+                for event in events:
+                    self.events(event)
+                trackers.append(tracker)
+            return trackers
+        for old, new in directions:
+            # Rearrange changes the old bom so every run gets its own copy of the trees
+            tracker = Tracker()
+            tracker.events, tracker.event_level = self.events, self.event_level
+            Rearrange(old.bom(), new.bom(), tracker, self.matching, self.blocking, thresholds=thresholds)
+            # The sink is not kept with the result, it may not be picklable for the cache
+            tracker.events = None
+            trackers.append(tracker)
+        return trackers
+
+    def threshold_sweep(self, thresholds_full: tuple = SWEEP_FULL, thresholds_partial: tuple = SWEEP_PARTIAL):
+        """Bom compare counts for every combination of the thresholds, used to pick threshold_full and
+        threshold_partial
+
+        Note:
+            The thresholds change which parts are renamed and rearranged, so Rearrange is run for every
+            combination. The trees are built once, and the description ratios are worked out once per
+            process and reused from compare.description_ratio. With processes more than 1 the combinations
+            are split between the workers. No events are made.
+
+        Parameters:
+            :param thresholds_full: threshold_full values to try
+            :param thresholds_partial: threshold_partial values to try
+
+        :return: dataframe with threshold_full, threshold_partial, full, partial, fn_only, removed and added
+            columns, one row per combination
+        """
+        if self.avl_bom is None or self.avl_bom_updated is None:
+            raise ValueError('Missing required fields, ccl, avl_new or avl_old')
+        settings = [(full, partial) for full in thresholds_full for partial in thresholds_partial]
+        snapshot, snapshot_updated = self.bom_snapshot(self.avl_bom), self.bom_snapshot(self.avl_bom_updated)
+        if self.processes > 1 and len(settings) > 1:
+            workers = min(self.processes, len(settings))
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # Each worker gets every nth setting, its ratio cache is reused for all of them
+                futures = [executor.submit(sweep_thresholds, snapshot, snapshot_updated, self.matching, self.blocking,
+                                           settings[worker::workers])
+                           for worker in range(workers)]
+                chunks = [future.result() for future in futures]
+            rows = [chunks[i % workers][i // workers] for i in range(len(settings))]
+        else:
+            rows = sweep_thresholds(snapshot, snapshot_updated, self.matching, self.blocking, settings)
+        return pd.DataFrame(rows, columns=['threshold_full', 'threshold_partial', 'full', 'partial', 'fn_only',
+                                           'removed', 'added'])
+
+    def clear_compare(self):
+        """Drops the kept snapshots and bom_compare result, the next bom_compare starts from the avl boms"""
+
+        self._snapshots = {}
+        self._compared = None
+
+    def bom_snapshot(self, avl_bom: pd.DataFrame):
+        """Tree of the avl bom as a compare.BomSnapshot, built on the first call for each avl bom"""
+
+        snapshot = self._snapshots.get(id(avl_bom))
+        if snapshot is None or snapshot.avl_bom is not avl_bom:
+            snapshot = BomSnapshot.from_avl(avl_bom)
+            # Snapshots of avl boms that have been replaced are dropped
+            self._snapshots = {key: kept for key, kept in self._snapshots.items()
+                               if kept.avl_bom is self.avl_bom or kept.avl_bom is self.avl_bom_updated}
+            self._snapshots[id(avl_bom)] = snapshot
+        return snapshot
 
     def save_compare(self, save_name: str):
         """Outputs the BOM comparison to a nice format
@@ -143,34 +412,94 @@ class CCL:
         path = os.path.join(os.getcwd(), 'bom compare temp')
         if not os.path.exists(path):
             os.makedirs(path)
+        CCL.save_report(path, tracker, tracker_reversed, self.avl_bom, self.avl_bom_updated)
+        # Zip and cleanup
+        shutil.make_archive(save_name.replace('.zip', ''), 'zip', path)
+        shutil.rmtree(path)
+
+    @staticmethod
+    def save_report(path: str, tracker: Tracker, tracker_reversed: Tracker, avl_bom: pd.DataFrame,
+                    avl_bom_updated: pd.DataFrame):
+        """Saves the changed.csv, removed.csv and added.csv of a bom compare into the folder path"""
+
         # Format changed.csv
         df_updated = tracker.combine_found().reset_index()
         changed = {'old index': [], 'old pn': [], 'old description': [],
                    'new index': [], 'new pn': [], 'new description': []}
         for idx in df_updated.index:
             changed['old index'].append(df_updated.loc[idx, 'old_idx'])
-            changed['old pn'].append(self.avl_bom.loc[df_updated.loc[idx, 'old_idx'], 'Name'])
-            changed['old description'].append(self.avl_bom.loc[df_updated.loc[idx, 'old_idx'], 'Description'])
+            changed['old pn'].append(avl_bom.loc[df_updated.loc[idx, 'old_idx'], 'Name'])
+            changed['old description'].append(avl_bom.loc[df_updated.loc[idx, 'old_idx'], 'Description'])
 
             changed['new index'].append(df_updated.loc[idx, 'new_idx'])
-            changed['new pn'].append(self.avl_bom_updated.loc[df_updated.loc[idx, 'new_idx'], 'Name'])
-            changed['new description'].append(self.avl_bom_updated.loc[df_updated.loc[idx, 'new_idx'], 'Description'])
+            changed['new pn'].append(avl_bom_updated.loc[df_updated.loc[idx, 'new_idx'], 'Name'])
+            changed['new description'].append(avl_bom_updated.loc[df_updated.loc[idx, 'new_idx'], 'Description'])
         pd.DataFrame.from_dict(changed).to_csv(os.path.join(path, 'changed.csv'))
         # Format removed.csv
         removed = {'Part Number': [], 'Description': []}
         for idx in tracker.not_found_to_df()['idx']:
-            removed['Part Number'].append(self.avl_bom.loc[idx, 'Name'])
-            removed['Description'].append(self.avl_bom.loc[idx, 'Description'])
+            removed['Part Number'].append(avl_bom.loc[idx, 'Name'])
+            removed['Description'].append(avl_bom.loc[idx, 'Description'])
         pd.DataFrame.from_dict(removed).to_csv(os.path.join(path, 'removed.csv'))
         # Format added.csv
         added = {'Part Number': [], 'Description': []}
         for idx in tracker_reversed.not_found_to_df()['idx']:
-            added['Part Number'].append(self.avl_bom_updated.loc[idx, 'Name'])
-            added['Description'].append(self.avl_bom_updated.loc[idx, 'Description'])
+            added['Part Number'].append(avl_bom_updated.loc[idx, 'Name'])
+            added['Description'].append(avl_bom_updated.loc[idx, 'Description'])
         pd.DataFrame.from_dict(added).to_csv(os.path.join(path, 'added.csv'))
-        # Zip and cleanup
-        shutil.make_archive(save_name.replace('.zip', ''), 'zip', path)
-        shutil.rmtree(path)
+
+    def compare_revisions(self, avl_bom_paths: list, cumulative: bool = False):
+        """Bom compare of every revision with the next one in a single run
+
+        Each avl bom is read and its tree built once no matter how many pairs it is in. All compares run
+        in worker processes when processes is more than 1. The avl boms are kept in revision_boms.
+
+        Parameters:
+            :param avl_bom_paths: filepaths to the avl multilevel boms, oldest revision first
+            :param cumulative: also compare the first revision with every revision after the next one
+
+        :return: list of (old path, new path, tracker, tracker_reversed), consecutive pairs first
+        """
+        if len(avl_bom_paths) < 2:
+            raise ValueError('At least two avl boms are needed')
+        self.revision_boms = {}
+        snapshots = {}
+        for path in avl_bom_paths:
+            if path not in snapshots:
+                self.revision_boms[path] = CCL.read_avl(path, lean=self.lean)
+                snapshots[path] = BomSnapshot.from_avl(self.revision_boms[path])
+        pairs = list(zip(avl_bom_paths, avl_bom_paths[1:]))
+        if cumulative:
+            pairs += [(avl_bom_paths[0], path) for path in avl_bom_paths[2:]]
+        directions = []
+        for old, new in pairs:
+            directions += [(snapshots[old], snapshots[new]), (snapshots[new], snapshots[old])]
+        trackers = self._run_compares(directions)
+        return [(old, new, trackers[2 * i], trackers[2 * i + 1]) for i, (old, new) in enumerate(pairs)]
+
+    def save_revisions(self, save_name: str, avl_bom_paths: list, cumulative: bool = False):
+        """Outputs compare_revisions to a nice format
+
+        Parameters:
+            :param save_name: Save name/ path of the zip file
+            :param avl_bom_paths: see compare_revisions
+            :param cumulative: see compare_revisions
+
+        :returns: outputs a zip file with an "old to new" folder for every pair, named after the files.
+            If two pairs would get the same name every folder starts with the number of its pair instead,
+            "1 old to new". Each folder has the same added.csv, changed.csv and removed.csv as save_compare
+        """
+        results = self.compare_revisions(avl_bom_paths, cumulative)
+        names = [' to '.join(os.path.splitext(os.path.basename(file))[0] for file in (old, new))
+                 for old, new, tracker, tracker_reversed in results]
+        if len(set(names)) < len(names):
+            names = [f'{number} {name}' for number, name in enumerate(names, 1)]
+        with tempfile.TemporaryDirectory() as path:
+            for name, (old, new, tracker, tracker_reversed) in zip(names, results):
+                folder = os.path.join(path, name)
+                os.makedirs(folder)
+                CCL.save_report(folder, tracker, tracker_reversed, self.revision_boms[old], self.revision_boms[new])
+            shutil.make_archive(save_name.replace('.zip', ''), 'zip', path)
 
 ########################################################################################################################
 # CCL Updating
@@ -215,10 +544,19 @@ class CCL:
             :param to_update: dataframe of to be updated parts
             :param ccledit: CCL edit object
         """
+        # Rows of all_updates by old part number, in order
+        updates_by_pn = {}
+        for to_update in all_updates.values:
+            updates_by_pn.setdefault(to_update[1], []).append(to_update)
+        # Old indexes already applied, the same old part can be listed more than once and under other part numbers
+        consumed_idx = set()
         for row in range(len(ccledit.table.rows)):
             pn = ccledit.get_text(row, 0)
-            if pn in all_updates['old_pn'].to_list():
-                to_update = all_updates.loc[pn == all_updates['old_pn']].values[0]
+            updates = updates_by_pn.get(pn, [])
+            while updates and updates[0][0] in consumed_idx:
+                del updates[0]
+            if updates:
+                to_update = updates[0]
                 # previous formatting
                 bold = ccledit.isbold(row, 0)
                 # Update fields
@@ -229,8 +567,7 @@ class CCL:
                 if bold:
                     ccledit.bold_row(row)
                 self._match_conditions(row, ccledit, to_update)
-                # Remove updated from df
-                all_updates = all_updates[all_updates.old_idx != to_update[0]]
+                consumed_idx.add(to_update[0])
 
     def _update_pn(self, row, to_update, ccledit):
         """Updates column 1, part number"""
@@ -244,6 +581,10 @@ class CCL:
 
         desc = self.avl_bom_updated.loc[to_update[2], 'Description']
         fn = self.avl_bom_updated.loc[to_update[2], 'F/N']
+        # F/N is read as float, show whole numbers without the .0
+        number = pd.to_numeric(fn, errors='coerce')
+        if not pd.isna(number) and float(number).is_integer():
+            fn = int(number)
         ccledit.set_text(row, 1, f'{desc} (#{fn})')
 
     def _update_manufacturer(self, row, to_update, ccledit):
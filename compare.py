@@ -6,14 +6,124 @@ Author: Steven Fu
 Last Edit: Steven Fu
 """
 
-from collections import Counter
+from collections import Counter, deque, namedtuple
+from functools import lru_cache
+import json
+import logging
+import re
 
+import numpy as np
 import pandas as pd
 from fuzzywuzzy import fuzz
 
-from copy import deepcopy
-
 import progressbar
+from package import Parent, LevelIndex, CompactTree, BomTree
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Description pairs kept by description_ratio, the same pairs come up again on every rearrange pass
+RATIO_CACHE_SIZE = 1 << 18
+# Ways Update can pick the new part of an old part, see update_part and assign_parts
+MATCHING = ('greedy', 'assignment')
+# Characters are counted in this many buckets (code point modulo) for the ratio upper bound
+HISTOGRAM_SIZE = 128
+# Most histogram cells compared at once by MatchMatrix, limits the memory used on large levels
+BOUND_CHUNK = 1 << 22
+# Assignment scores, any full match is worth more than a partial match with the same ratio
+SCORE_FULL = 200
+SCORE_PARTIAL = 100
+# Description match percentages of ismatch, full also needs the same F/N
+THRESHOLD_FULL = 50
+THRESHOLD_PARTIAL = 80
+# Increase when the result of Rearrange changes so old cached compare results are not used
+COMPARE_VERSION = 3
+
+
+class DescriptionCache:
+    """Descriptions of every row prepared once for matching
+
+    Note:
+        A missing description is an empty string. Arrays are positional like PartColumns.
+
+    Attributes:
+        desc (ndarray): the descriptions
+        type (ndarray): part type, the description before the first *
+        tokens (list): frozenset of the upper case words and numbers of every description
+        length (ndarray): number of characters
+        histogram (ndarray): character counts, see HISTOGRAM_SIZE. Used for an upper bound of fuzz.ratio
+    """
+    def __init__(self, descriptions):
+        desc = pd.Series(descriptions).astype(object)
+        self.desc = desc.where(desc.notna(), '').to_numpy(dtype=object)
+        self.type = np.array([value.split('*')[0] for value in self.desc], dtype=object)
+        self.tokens = [frozenset(re.findall(r'[A-Z0-9]+', value.upper())) for value in self.desc]
+        self.length = np.array([len(value) for value in self.desc], dtype=np.int64)
+        self.histogram = np.zeros((len(self.desc), HISTOGRAM_SIZE), dtype=np.int32)
+        for pos, value in enumerate(self.desc):
+            if value:
+                codes = np.frombuffer(value.encode('utf-32-le'), dtype=np.uint32) % HISTOGRAM_SIZE
+                self.histogram[pos] = np.bincount(codes, minlength=HISTOGRAM_SIZE)
+
+
+class PartColumns:
+    """Name, F/N and description of every row of the avl bom, used by MatchMatrix and Rearrange
+
+    Attributes:
+        position (dict): index label to row position
+        names (ndarray): Name column
+        rows_by_name (dict): part number to the index labels of every row with it, in bom order
+        fn (ndarray): F/N column
+        descriptions (DescriptionCache): Description column prepared for matching
+        fingerprints (list): hash of the Name, F/N and Description of the rows below every row, see
+            LevelIndex.fingerprints. Made by subtree_fingerprints
+    """
+    def __init__(self, avl_bom):
+        self.position = {label: pos for pos, label in enumerate(avl_bom.index)}
+        self.names = avl_bom['Name'].to_numpy(dtype=object)
+        self.rows_by_name = {}
+        for label, name in zip(avl_bom.index, self.names):
+            self.rows_by_name.setdefault(name, []).append(label)
+        self.fn = avl_bom['F/N'].to_numpy()
+        self.descriptions = DescriptionCache(avl_bom['Description'].to_numpy(dtype=object))
+        self.fingerprints = None
+
+    def subtree_fingerprints(self, level_index: LevelIndex):
+        """Fingerprints of every row, made on the first call
+
+        Rows with a missing F/N are excluded since Update never sees their F/N as the same
+        """
+        if self.fingerprints is None:
+            excluded = pd.isna(self.fn)
+            self.fingerprints = level_index.fingerprints([self.names, self.fn, self.descriptions.desc], excluded)
+        return self.fingerprints
+
+    def positions(self, parts: list):
+        """Row positions of the (index, part number) parts"""
+
+        return np.array([self.position[idx] for idx, pn in parts], dtype=np.int64)
+
+    def has_name(self, pn):
+        """True if any row has the part number"""
+
+        return pn in self.rows_by_name
+
+    def first_row(self, pn):
+        """Index label of the first row with the part number, KeyError if there is none"""
+
+        return self.rows_by_name[pn][0]
+
+    def name(self, label):
+        """Part number of the row"""
+
+        return self.names[self.position[label]]
+
+    def find_number(self, label):
+        """F/N of the row, same as avl_bom.loc[label, 'F/N']"""
+
+        return self.fn[self.position[label]]
 
 
 class Bom:
@@ -22,15 +132,68 @@ class Bom:
     Attributes:
         bom (dataframe): the avl multilevel bom
         parent (dict): - Containing nested keys to show level information
-                       - In the format of [Index, Part number]
+                       - In the format of [Index, Part number], either 'idx pn' strings or (idx, pn) tuples
         parent_list (list): parent attribute but as a list for easy iter
+        split_list (list): parent_list split into (index, part number)
         top_pn (list): Part numbers at highest level
+        level_index (LevelIndex): parent/ subtree arrays of the avl bom, shared by all branches
+        tuple_keys (bool): True if the keys of parent are (idx, pn) tuples
+        part_columns (PartColumns): F/N and description arrays, made on first use and shared by all branches
+        tree (BomTree): key to parent map of the whole tree shared by all branches, None if not indexed.
+            Set by Rearrange so parts can be moved and renamed without searching the tree
     """
-    def __init__(self, avl_bom, parent):
+    def __init__(self, avl_bom, parent, level_index: LevelIndex = None, tuple_keys: bool = None,
+                 part_columns: PartColumns = None, tree: BomTree = None):
         self.bom = avl_bom
         self.parent = parent
         self.parent_list = list(parent)
-        self.top_pn = [Bom._split_key(pn)[1] for pn in self.parent]
+        self.split_list = [Bom._split_key(key) for key in self.parent_list]
+        self.top_pn = [pn for idx, pn in self.split_list]
+        if level_index is None:
+            level_index = LevelIndex(avl_bom['Level'], avl_bom.index)
+        self.level_index = level_index
+        if tuple_keys is None:
+            tuple_keys = bool(self.parent_list) and isinstance(self.parent_list[0], tuple)
+        self.tuple_keys = tuple_keys
+        self._part_columns = part_columns
+        self.tree = tree
+
+    @property
+    def part_columns(self):
+        if self._part_columns is None:
+            self._part_columns = PartColumns(self.bom)
+        return self._part_columns
+
+    def branch(self, parent):
+        """Creates a Bom object of a lower level that shares the same avl bom and index"""
+
+        return Bom(self.bom, parent, self.level_index, self.tuple_keys, self.part_columns, self.tree)
+
+    def same_below(self, key, other_bom, other_key):
+        """True if the parts below key are the same as the parts below other_key of other_bom
+
+        Checked with the subtree fingerprints of the avl boms. A branch that Rearrange moved a part into
+        or out of is never the same, since its fingerprint is of the bom before the move.
+        """
+        if self.tree is not None and key in self.tree.changed:
+            return False
+        idx, other_idx = Bom._split_key(key)[0], Bom._split_key(other_key)[0]
+        fingerprint = self.part_columns.subtree_fingerprints(self.level_index)[self.part_columns.position[idx]]
+        other_fingerprints = other_bom.part_columns.subtree_fingerprints(other_bom.level_index)
+        return fingerprint is not None and fingerprint == other_fingerprints[other_bom.part_columns.position[other_idx]]
+
+    def subtree_parts(self, key):
+        """(index, part number) of every part below key"""
+
+        idx = Bom._split_key(key)[0]
+        return [(int(label), self.part_columns.name(label)) for label in self.level_index.subtree(idx)]
+
+    def key(self, index, pn):
+        """Creates a key of parent given index and part number"""
+
+        if self.tuple_keys:
+            return index, pn
+        return f'{index} {pn}'
 
     def __sub__(self, other_bom):
         """Sub self.parent_list between self.parent_list another bom Object
@@ -42,14 +205,30 @@ class Bom:
 
         Return: only the part numbers and index number (int) that exists in this self instance
         """
-        return [Bom._split_key(self.parent_list[i])
-                for i in range(len(self.top_pn)) if self.top_pn[i] not in other_bom.top_pn]
+        other_pn = set(other_bom.top_pn)
+        return [self.split_list[i]
+                for i in range(len(self.top_pn)) if self.top_pn[i] not in other_pn]
+
+    @staticmethod
+    def pn_queues(split_list: list):
+        """Part number to a deque of its (index, part number) parts, in list order
+
+        Popping from the left gives the first remaining part with that part number, like list.index
+        followed by pop without the linear search
+        """
+        queues = {}
+        for part in split_list:
+            queues.setdefault(part[1], deque()).append(part)
+        return queues
 
     @staticmethod
     def _split_key(key: str):
-        """Splits the key into index and part number both in (int)"""
+        """Splits the key into index (int) and part number (str), tuple keys are already split"""
 
-        return int(key.split()[0]), key.split()[1]
+        if isinstance(key, tuple):
+            return key
+        idx, pn = key.split()[:2]
+        return int(idx), pn
 
     def intersect(self, other_bom):
         """Find the intersection between two BOM
@@ -58,24 +237,18 @@ class Bom:
 
         :return: the index and pn of current instance (self) that are in common with another instance of BOM
         """
-        intersect_list = list((Counter(self.top_pn) & Counter(other_bom.top_pn)).elements())
-        copy_top = self.top_pn.copy()
-        copy_parent = self.parent_list.copy()
-        output = []
-        for item in intersect_list:
-            index = copy_top.index(item)
-            del copy_top[index]
-            output.append(Bom._split_key(copy_parent.pop(index)))
+        intersect_list = (Counter(self.top_pn) & Counter(other_bom.top_pn)).elements()
+        queues = Bom.pn_queues(self.split_list)
+        output = [queues[item].popleft() for item in intersect_list]
         return sorted(output, key=lambda output: output[1])
 
     def immediate_parent(self, index: int):
         """Finds the immediate parent of given index number"""
 
-        parent_level = self.bom.loc[index, 'Level'] - 1
-        for idx in range(index, -1, -1):
-            if self.bom.loc[idx, 'Level'] == parent_level:
-                return idx, self.bom.loc[idx, 'Name']
-        return None
+        idx = self.level_index.immediate_parent(index)
+        if idx is None:
+            return None
+        return idx, self.part_columns.name(idx)
 
     @staticmethod
     def zip_intersect(bom_old, bom_new):
@@ -91,24 +264,97 @@ class Bom:
 
         :return: list in format mentioned above. Only contains intersection (common) items between the two boms
         """
-        a = list(bom_old.parent)
-        b = list(bom_new.parent)
-        pa = [pn.split()[1] for pn in a]
-        pb = [pn.split()[1] for pn in b]
+        queues = Bom.pn_queues([Bom._split_key(key) for key in bom_new.parent])
         intersect_list = []
-        for pn in range(len(pa)):
-            if pa[pn] in pb:
-                index_a = int(a[pn].split()[0])
-                pn_a = a[pn].split()[1]
+        for key in bom_old.parent:
+            part_a = Bom._split_key(key)
+            # Each new part is paired once, with the first old part of the same part number
+            if queues.get(part_a[1]):
+                intersect_list.append([part_a, queues[part_a[1]].popleft()])
+        return intersect_list
 
-                index_b = int(b[pb.index(pa[pn])].split()[0])
-                pn_b = b[pb.index(pa[pn])].split()[1]
 
-                b.pop(pb.index(pa[pn]))
-                pb.pop(pb.index(pa[pn]))
+class BomSnapshot:
+    """Read only copy of a bom tree that every compare starts from
 
-                intersect_list.append([(index_a, pn_a), (index_b, pn_b)])
-        return intersect_list
+    Note:
+        Rearrange changes the tree of the old bom in place, so each run needs its own dictionaries.
+        The snapshot keeps the CompactTree with the keys, level index and PartColumns made once, these
+        are never changed and are shared by every Bom made from it. bom only builds new dictionaries
+        from the arrays, no searching or rebuilding from the avl bom.
+
+    Attributes:
+        avl_bom (dataframe): the avl multilevel bom
+        compact (CompactTree): the tree
+        level_index (LevelIndex): parent/ subtree arrays of the avl bom
+        keys (list): (idx, pn) key of every node of compact
+        part_columns (PartColumns): shared by every Bom made from the snapshot
+    """
+    def __init__(self, avl_bom, compact: CompactTree, level_index: LevelIndex):
+        self.avl_bom = avl_bom
+        self.compact = compact
+        self.level_index = level_index
+        self.keys = compact.keys(tuple_keys=True)
+        self.part_columns = PartColumns(avl_bom)
+
+    @classmethod
+    def from_avl(cls, avl_bom):
+        """Builds the tree of the avl bom"""
+
+        parent = Parent(avl_bom)
+        return cls(avl_bom, parent.build_compact(), parent.level_index)
+
+    def bom(self):
+        """New Bom object with its own tree, can be changed without affecting the snapshot"""
+
+        parent = self.compact.to_dict(tuple_keys=True, keys=self.keys)
+        return Bom(self.avl_bom, parent, self.level_index, tuple_keys=True, part_columns=self.part_columns)
+
+
+class Updated(namedtuple('Updated', ['part_old', 'desc_old', 'part_new', 'desc_new', 'match_type'])):
+    """Event of an old part matched to a new part, match_type is full or partial"""
+    __slots__ = ()
+    LEVEL = logging.INFO
+
+    def __str__(self):
+        return f'{self.part_old[1]} {self.desc_old} updated to {self.part_new[1]} {self.desc_new}'
+
+
+class Rearranged(namedtuple('Rearranged', ['part', 'parent'])):
+    """Event of a not found part moved under the (index, part number) parent by Rearrange"""
+    __slots__ = ()
+    LEVEL = logging.INFO
+
+    def __str__(self):
+        return f'{self.part[0]} {self.part[1]} has been rearranged to be under {self.parent[0]} {self.parent[1]}'
+
+
+class NotFound(namedtuple('NotFound', ['part'])):
+    """Event of a part that is still not found after Rearrange"""
+    __slots__ = ()
+    LEVEL = logging.WARNING
+
+    def __str__(self):
+        return f'{self.part[1]} was not found'
+
+
+def print_event(event):
+    """Event sink that prints the event like the compare messages"""
+
+    print(event)
+
+
+class EventWriter:
+    """Event sink that writes every event as a json line, {"event": class name, fields...}
+
+    Attributes:
+        file: text file the lines are written to
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def __call__(self, event):
+        self.file.write(json.dumps({'event': type(event).__name__, **event._asdict()}, default=str) + '\n')
 
 
 class Tracker:
@@ -116,46 +362,96 @@ class Tracker:
 
     Tracker is used in to track the updates during the recursive process of "update" and "rearrange"
 
+    Note:
+        Matches are kept as lists of rows and only turned into dataframes when read, appending a row
+        does not copy the previous rows.
+
     Attributes:
         full_match (dataframe): pandas dataframe that contains all parts found to be full match
         partial_match (dataframe): pandas dataframe that contains all parts found to be partial match
         find_only (dataframe): pandas dataframe that contains all parts found to be find only match
         not_found (set): a list of unique not found part numbers
-        used (list): a list of already scanned part numbers to prevent duplicates
+        used (set): already scanned parts (index, part number) to prevent duplicates
+        log (list): matches and not found parts in the order they were added, only kept when not None.
+            Used by UpdateMemo
+        events: callable given every Updated, Rearranged and NotFound event, None to not make any events
+        event_level (int): logging level, events with a lower LEVEL are not made
 
     All dataframes contain the same column headers for easy data manipulation as shown in COLUMNS
     """
     COLUMNS = ['old_idx', 'old_pn', 'new_idx', 'new_pn']
+    MATCH_TYPES = (('full', 'full'), ('partial', 'partial'), ('find_only', 'fn_only'))
 
     def __init__(self):
-        self.full_match = pd.DataFrame(columns=self.COLUMNS)
-        self.partial_match = pd.DataFrame(columns=self.COLUMNS)
-        self.find_only = pd.DataFrame(columns=self.COLUMNS)
+        self.rows = {'full': [], 'partial': [], 'find_only': []}
         self.not_found = set()
-        self.used = []
+        self.used = set()
+        self.log = None
+        self.events = None
+        self.event_level = logging.INFO
+        self._combined = None
+
+    def emits(self, event_type):
+        """True if events of the type are wanted, check before making the event so nothing is done if not"""
+
+        return self.events is not None and event_type.LEVEL >= self.event_level
+
+    def emit(self, event):
+        self.events(event)
+
+    @property
+    def full_match(self):
+        return self._to_df('full')
+
+    @property
+    def partial_match(self):
+        return self._to_df('partial')
+
+    @property
+    def find_only(self):
+        return self._to_df('find_only')
+
+    def _to_df(self, match):
+        return pd.DataFrame(self.rows[match], columns=self.COLUMNS)
+
+    def _append(self, match, part_old, part_new):
+        self.rows[match].append(tuple(part_old) + tuple(part_new))
+        self._combined = None
+        if self.log is not None:
+            self.log.append((match, part_old, part_new))
 
     def append_full(self, part_old, part_new):
         """Append full match parts to the full_match dataframe"""
 
-        self.used.append(part_new)
-        append = pd.DataFrame([part_old + part_new],
-                              columns=self.COLUMNS)
-        self.full_match = pd.concat([self.full_match, append], ignore_index=True)
+        self.used.add(part_new)
+        self._append('full', part_old, part_new)
 
     def append_partial(self, part_old, part_new):
         """Append partial match parts to the partial_match dataframe"""
 
-        self.used.append(part_new)
-        append = pd.DataFrame([part_old + part_new],
-                              columns=self.COLUMNS)
-        self.partial_match = pd.concat([self.partial_match, append], ignore_index=True)
+        self.used.add(part_new)
+        self._append('partial', part_old, part_new)
 
     def append_find_only(self, part_old, part_new):
         """Appaned matched parts to the find_only dataframe"""
 
-        append = pd.DataFrame([part_old + part_new],
-                              columns=self.COLUMNS)
-        self.find_only = pd.concat([self.find_only, append], ignore_index=True)
+        self._append('find_only', part_old, part_new)
+
+    def add_not_found(self, part):
+        """Adds the part to the not_found set"""
+
+        self.not_found.add(part)
+        if self.log is not None:
+            self.log.append(('not_found', part))
+
+    def replay(self, events):
+        """Adds logged find only matches and not found parts again, see UpdateMemo"""
+
+        for event in events:
+            if event[0] == 'find_only':
+                self.append_find_only(event[1], event[2])
+            else:
+                self.add_not_found(event[1])
 
     def not_found_to_df(self):
         """Convers the not_found list to a dataframe"""
@@ -166,7 +462,7 @@ class Tracker:
     def isused(self, part):
         """Check if part has been used"""
 
-        return True if part in self.used else False
+        return part in self.used
 
     def reset_not_found(self):
         """Resets not found set"""
@@ -174,17 +470,23 @@ class Tracker:
         self.not_found = set()
 
     def combine_found(self):
-        """Combines all match types into one and inserts match type column"""
+        """Combines all match types into one and inserts match type column
 
-        self.full_match.insert(4, 'match_type', 'full')
-        self.partial_match.insert(4, 'match_type', 'partial')
-        self.find_only.insert(4, 'match_type', 'fn_only')
-        combined = pd.concat([self.full_match, self.partial_match, self.find_only])
-        return combined.sort_values(by=['old_idx'])
+        The result is kept until the next append so calling it again does not rebuild it.
+        """
+        if self._combined is None:
+            frames = []
+            for match, match_type in self.MATCH_TYPES:
+                df = self._to_df(match)
+                df.insert(4, 'match_type', match_type)
+                frames.append(df)
+            # Stable sort keeps full, partial then find only for parts with the same old index
+            self._combined = pd.concat(frames).sort_values(by=['old_idx'], kind='mergesort')
+        return self._combined.copy()
 
 
 def ismatch(bom_old: Bom, part_old: tuple, bom_new: Bom, part_new: tuple,
-            threshold_full: int = 50, threshold_partial: int = 80):
+            threshold_full: int = THRESHOLD_FULL, threshold_partial: int = THRESHOLD_PARTIAL):
     """Determines the match type given a part and BOM
 
     There are 3 types match types in total, 2 are determined in this method (full match, partial match)
@@ -216,7 +518,161 @@ def ismatch(bom_old: Bom, part_old: tuple, bom_new: Bom, part_new: tuple,
     return False
 
 
-def update_part(bom_old: Bom, part_old: tuple, bom_new: Bom, exclusive_new: list, tracker: Tracker):
+@lru_cache(maxsize=RATIO_CACHE_SIZE)
+def description_ratio(old_desc: str, new_desc: str):
+    """fuzz.ratio of two descriptions, cached"""
+
+    return fuzz.ratio(old_desc, new_desc)
+
+
+class MatchMatrix:
+    """ismatch for every old and new part pair of one level
+
+    F/N and type (description before the *) equality are compared as arrays once per level. The
+    description ratio is only worked out for the pairs the greedy search in update_part reaches, once
+    per unique description pair, and is then shared by the full and partial passes.
+
+    Note:
+        fuzz.ratio is at most 2 * shared characters / total characters, where shared characters are
+        counted from the DescriptionCache histograms. Pairs whose bound is under a threshold can not
+        pass it and never reach the scorer, this does not change any result.
+        With blocking, only pairs of the same type or with a shared token are scored at all. This
+        can miss partial matches of descriptions with no word in common.
+
+    Attributes:
+        exclusive_old (list): old parts, one per row
+        exclusive_new (list): new parts, one per column
+        same_fn (ndarray): True where the F/N of the pair is equal
+        same_type (ndarray): True where the type of the pair is equal
+        bound (ndarray): upper bound of the ratio of the unique description pairs
+        ratio (ndarray): description match percentage of the unique description pairs, -1 if not worked out
+    """
+    def __init__(self, bom_old: Bom, exclusive_old: list, bom_new: Bom, exclusive_new: list,
+                 threshold_full: int = THRESHOLD_FULL, threshold_partial: int = THRESHOLD_PARTIAL,
+                 blocking: bool = False):
+        self.exclusive_old = exclusive_old
+        self.exclusive_new = exclusive_new
+        self.threshold_full = threshold_full
+        self.threshold_partial = threshold_partial
+        old_pos = bom_old.part_columns.positions(exclusive_old)
+        new_pos = bom_new.part_columns.positions(exclusive_new)
+        old_cache, new_cache = bom_old.part_columns.descriptions, bom_new.part_columns.descriptions
+        self.old_codes, old_first = MatchMatrix._factorize(old_cache.desc[old_pos])
+        self.new_codes, new_first = MatchMatrix._factorize(new_cache.desc[new_pos])
+        # Position of every unique description
+        old_first, new_first = old_pos[old_first], new_pos[new_first]
+        self.old_unique, self.new_unique = old_cache.desc[old_first], new_cache.desc[new_first]
+        self.ratio = np.full((len(old_first), len(new_first)), -1, dtype=np.int16)
+
+        self.same_fn = bom_old.part_columns.fn[old_pos][:, None] == bom_new.part_columns.fn[new_pos][None, :]
+        same_type = old_cache.type[old_first][:, None] == new_cache.type[new_first][None, :]
+        self.same_type = same_type[self.old_codes[:, None], self.new_codes[None, :]]
+        self.bound = MatchMatrix._ratio_bound(old_cache, old_first, new_cache, new_first)
+        if blocking:
+            shared = MatchMatrix._shared_tokens(old_cache, old_first, new_cache, new_first)
+            self.bound[~(same_type | shared)] = 0
+
+    @staticmethod
+    def _factorize(values):
+        """Codes and position of the first of each unique value, pd.factorize is slow for the few parts of a level"""
+
+        codes, first = {}, []
+        for pos, value in enumerate(values):
+            if value not in codes:
+                codes[value] = len(codes)
+                first.append(pos)
+        return np.array([codes[value] for value in values], dtype=np.int64), np.array(first, dtype=np.int64)
+
+    @staticmethod
+    def _ratio_bound(old_cache: DescriptionCache, old_first, new_cache: DescriptionCache, new_first):
+        """Upper bound of fuzz.ratio for every unique description pair, see the class note"""
+
+        old_hist, new_hist = old_cache.histogram[old_first], new_cache.histogram[new_first]
+        total = old_cache.length[old_first][:, None] + new_cache.length[new_first][None, :]
+        shared = np.zeros(total.shape, dtype=np.int64)
+        step = max(1, BOUND_CHUNK // max(1, len(new_first) * HISTOGRAM_SIZE))
+        for start in range(0, len(old_first), step):
+            shared[start:start + step] = \
+                np.minimum(old_hist[start:start + step, None, :], new_hist[None, :, :]).sum(axis=2)
+        # Empty descriptions are left to the scorer
+        bound = np.full(total.shape, 100, dtype=np.int64)
+        np.ceil(200 * shared / np.maximum(total, 1), out=bound, where=total > 0, casting='unsafe')
+        return bound
+
+    @staticmethod
+    def _shared_tokens(old_cache: DescriptionCache, old_first, new_cache: DescriptionCache, new_first):
+        """True for the unique description pairs with at least one token in common"""
+
+        by_token = {}
+        for col, pos in enumerate(new_first):
+            for token in new_cache.tokens[pos]:
+                by_token.setdefault(token, []).append(col)
+        shared = np.zeros((len(old_first), len(new_first)), dtype=bool)
+        for row, pos in enumerate(old_first):
+            for token in old_cache.tokens[pos]:
+                shared[row, by_token.get(token, [])] = True
+        return shared
+
+    def match_ratio(self, row: int, col: int):
+        """Description match percentage of a pair"""
+
+        old, new = self.old_codes[row], self.new_codes[col]
+        if self.ratio[old, new] < 0:
+            self.ratio[old, new] = description_ratio(self.old_unique[old], self.new_unique[new])
+        return self.ratio[old, new]
+
+    def reaches(self, row: int, col: int, threshold: int):
+        """True if the ratio of the pair is at least threshold, the scorer is skipped if the bound is lower"""
+
+        if self.bound[self.old_codes[row], self.new_codes[col]] < threshold:
+            return False
+        return self.match_ratio(row, col) >= threshold
+
+    def isfull(self, row: int, col: int):
+        return self.same_fn[row, col] and \
+               (self.same_type[row, col] or self.reaches(row, col, self.threshold_full))
+
+    def match_type(self, row: int, col: int):
+        """Same as ismatch for the pair"""
+
+        if self.isfull(row, col):
+            return 'full'
+        elif self.reaches(row, col, self.threshold_partial):
+            return 'partial'
+        return False
+
+    def scores(self):
+        """Score of every pair for assign_parts, SCORE_FULL or SCORE_PARTIAL plus the ratio, 0 if no match
+
+        Works out the ratio of every pair
+        """
+        scores = np.zeros((len(self.exclusive_old), len(self.exclusive_new)), dtype=np.int64)
+        for row in range(len(self.exclusive_old)):
+            for col in range(len(self.exclusive_new)):
+                match_type = self.match_type(row, col)
+                if match_type:
+                    bonus = SCORE_FULL if match_type == 'full' else SCORE_PARTIAL
+                    scores[row, col] = bonus + self.match_ratio(row, col)
+        return scores
+
+    def candidates(self, row: int, match_type: str):
+        """New parts of the row with the match type, in exclusive_new order
+
+        Is a generator so the ratio of pairs after the part picked by update_part is never worked out
+        """
+        # Pairs whose ratio bound is under the threshold can not have the match type
+        bound = self.bound[self.old_codes[row]][self.new_codes]
+        if match_type == 'full':
+            cols = np.flatnonzero(self.same_fn[row] & (self.same_type[row] | (bound >= self.threshold_full)))
+        else:
+            cols = np.flatnonzero(bound >= self.threshold_partial)
+        for col in cols:
+            if self.match_type(row, col) == match_type:
+                yield self.exclusive_new[col]
+
+
+def update_part(bom_old: Bom, part_old: tuple, bom_new: Bom, exclusive_new: list, tracker: Tracker,
+                matrix: MatchMatrix = None, row: int = 0):
     """Using ismatch function, formats and determines the updated parts
 
     This method is mainly used for formating purposes. Will populate the tracker class by determining
@@ -228,37 +684,146 @@ def update_part(bom_old: Bom, part_old: tuple, bom_new: Bom, exclusive_new: list
         :param bom_new: bom object of the new bom
         :param exclusive_new: list of part number that contain parts exclusive to the new bom
         :param tracker: tracker class used to track recursion results
+        :param matrix: MatchMatrix of the level, the match types of part_old are looked up instead of
+            calling ismatch. Made for part_old only if not given
+        :param row: row of part_old in the matrix
 
     :return: Nothing, will simply update the tracker
     """
-    # Run once through once for full match
-    for part_new in exclusive_new:
-        match_status = ismatch(bom_old, part_old, bom_new, part_new)
-        if match_status == 'full' and not tracker.isused(part_new):
-            print(f'{part_old[1]} {bom_old.bom.loc[part_old[0], "Description"]} updated to '
-                  f'{part_new[1]} {bom_new.bom.loc[part_new[0], "Description"]}')
-            tracker.append_full(part_old, part_new)
-
-            bom_old.parent[f'{part_old[0]} {part_new[1]}'] = \
-                bom_old.parent.pop(f'{part_old[0]} {part_old[1]}')
-            return
-    # Run again through for partial match
-    for part_new in exclusive_new:
-        match_status = ismatch(bom_old, part_old, bom_new, part_new)
-        if match_status == 'partial' and not tracker.isused(part_new):
-            print(f'{part_old[1]} {bom_old.bom.loc[part_old[0], "Description"]} updated to '
-                  f'{part_new[1]} {bom_new.bom.loc[part_new[0], "Description"]}')
-            tracker.append_partial(part_old, part_new)
-
-            bom_old.parent[f'{part_old[0]} {part_new[1]}'] = \
-                bom_old.parent.pop(f'{part_old[0]} {part_old[1]}')
-            return
-
-    tracker.not_found.add(part_old)
+    if matrix is None:
+        matrix, row = MatchMatrix(bom_old, [part_old], bom_new, exclusive_new), 0
+    # Run once through once for full match, then again for partial match
+    for match_type in ('full', 'partial'):
+        for part_new in matrix.candidates(row, match_type):
+            if not tracker.isused(part_new):
+                apply_match(bom_old, part_old, bom_new, part_new, tracker, match_type)
+                return
+
+    tracker.add_not_found(part_old)
     return
 
 
-def Update(bom_old: Bom, bom_new: Bom, tracker: Tracker):
+def apply_match(bom_old: Bom, part_old: tuple, bom_new: Bom, part_new: tuple, tracker: Tracker, match_type: str):
+    """Adds the match to the tracker and renames the old part in bom_old.parent to the new part number
+
+    :param match_type: full or partial
+    """
+    if tracker.emits(Updated):
+        tracker.emit(Updated(part_old, bom_old.bom.loc[part_old[0], 'Description'],
+                             part_new, bom_new.bom.loc[part_new[0], 'Description'], match_type))
+    if match_type == 'full':
+        tracker.append_full(part_old, part_new)
+    else:
+        tracker.append_partial(part_old, part_new)
+
+    key_old, key_new = bom_old.key(*part_old), bom_old.key(part_old[0], part_new[1])
+    if bom_old.tree is not None and bom_old.tree.parents.get(key_old) is bom_old.parent:
+        bom_old.tree.rename(key_old, key_new)
+    else:
+        bom_old.parent[key_new] = bom_old.parent.pop(key_old)
+
+
+def assign_parts(bom_old: Bom, bom_new: Bom, matrix: MatchMatrix, tracker: Tracker):
+    """Assignment version of update_part for every old part of the level at once
+
+    Instead of each old part taking the first unused new part that matches, the one to one pairing
+    with the highest total score (see MatchMatrix.scores) is picked, so the result does not depend on
+    the order of the parts. New parts that are already used are left out.
+
+    Parameter:
+        :param bom_old: bom object of the old bom
+        :param bom_new: bom object of the new bom
+        :param matrix: MatchMatrix of the level
+        :param tracker: tracker class used to track recursion results
+    """
+    scores = matrix.scores()
+    for col, part_new in enumerate(matrix.exclusive_new):
+        if tracker.isused(part_new):
+            scores[:, col] = 0
+    assigned = {}
+    for row, col in zip(*max_assignment(scores)):
+        if scores[row, col] > 0:
+            assigned[row] = col
+    # Applied in exclusive_old order like update_part
+    for row, part_old in enumerate(matrix.exclusive_old):
+        try:
+            if row in assigned:
+                part_new = matrix.exclusive_new[assigned[row]]
+                apply_match(bom_old, part_old, bom_new, part_new, tracker, matrix.match_type(row, assigned[row]))
+            else:
+                tracker.add_not_found(part_old)
+        except KeyError:
+            # Any errors occur means part was not found and needs review
+            tracker.add_not_found(part_old)
+
+
+def max_assignment(scores: np.ndarray):
+    """Rows and columns of the one to one pairing with the highest total score
+
+    Uses scipy when installed, _hungarian otherwise
+
+    :return: row indices, column indices
+    """
+    if scores.size == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(scores, maximize=True)
+    cost = scores.max() - scores
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = _hungarian(cost.T)
+    else:
+        rows, cols = _hungarian(cost)
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _hungarian(cost: np.ndarray):
+    """Minimum cost assignment of every row, needs rows <= columns
+
+    Shortest augmenting path version of the hungarian algorithm, O(rows^2 * columns). Arrays are
+    1 based with column 0 standing for the row being added.
+
+    :return: row indices, column indices
+    """
+    rows, cols = cost.shape
+    u = np.zeros(rows + 1)
+    v = np.zeros(cols + 1)
+    # Row matched to each column, 0 if none
+    match = np.zeros(cols + 1, dtype=np.int64)
+    way = np.zeros(cols + 1, dtype=np.int64)
+    for row in range(1, rows + 1):
+        match[0] = row
+        col0 = 0
+        min_v = np.full(cols + 1, np.inf)
+        used = np.zeros(cols + 1, dtype=bool)
+        while True:
+            used[col0] = True
+            free = ~used[1:]
+            reduced = cost[match[col0] - 1] - u[match[col0]] - v[1:]
+            better = np.flatnonzero(free & (reduced < min_v[1:])) + 1
+            min_v[better] = reduced[better - 1]
+            way[better] = col0
+            masked = np.where(free, min_v[1:], np.inf)
+            col1 = int(np.argmin(masked)) + 1
+            delta = masked[col1 - 1]
+            used_cols = np.flatnonzero(used)
+            u[match[used_cols]] += delta
+            v[used_cols] -= delta
+            min_v[1:][free] -= delta
+            col0 = col1
+            if match[col0] == 0:
+                break
+        # Flip the augmenting path
+        while col0:
+            col1 = way[col0]
+            match[col0] = match[col1]
+            col0 = col1
+    assigned = np.flatnonzero(match[1:]) + 1
+    return match[assigned] - 1, assigned - 1
+
+
+def Update(bom_old: Bom, bom_new: Bom, tracker: Tracker, matching: str = 'greedy', blocking: bool = False,
+           memo=None, skip_same: bool = True, thresholds: tuple = (THRESHOLD_FULL, THRESHOLD_PARTIAL)):
     """Main updater class without rearrange
 
     Recurssivly scans through the BOM only comparing parent and child parts, not entire BOM and not child of child
@@ -273,49 +838,138 @@ def Update(bom_old: Bom, bom_new: Bom, tracker: Tracker):
         :param bom_old: Bom object for the old bom
         :param bom_new: bom object for the new bom
         :param tracker: tracker for updating parts
+        :param matching: greedy to match each old part with update_part, assignment to match the level
+            at once with assign_parts
+        :param blocking: only score descriptions of the same type or with a shared word, see MatchMatrix
+        :param memo: UpdateMemo, branches that did not change since their last Update are replayed from it
+        :param skip_same: do not go into branches where everything below is the same in both boms, see
+            Bom.same_below. Update would only mark their parts as used, so this is done directly instead
+        :param thresholds: (threshold_full, threshold_partial) description match percentages, see ismatch
 
     :return: nothing, will simply update the tracker class
     """
+    if matching not in MATCHING:
+        raise ValueError(f'matching must be one of {MATCHING}')
     # Creates exclusive lists for easy iteration, uses __sub__ inside of Bom
     exclusive_old = bom_old - bom_new
     exclusive_new = bom_new - bom_old
     # Checks to see if only find number has been changed
     # Will check for matching part numbers, disregarding find number (F/N)
-    # Creates a deep copy for manipulation
-    deep_copy_parent = deepcopy(bom_new.parent_list)
-    deep_copy_top = deepcopy(bom_new.top_pn)
+    # Each new part can only be paired once, queues are popped as they are used
+    queues = Bom.pn_queues(bom_new.split_list)
+    skip = set(exclusive_old)
     for part in bom_old.parent:
         key_old = Bom._split_key(part)
-        if key_old not in exclusive_old:
-            try:
-                index = deep_copy_top.index(key_old[1])
-                key_new = Bom._split_key(deep_copy_parent.pop(index))
-                del deep_copy_top[index]
-                if bom_old.bom.loc[key_old[0], 'F/N'] != bom_new.bom.loc[key_new[0], 'F/N']:
+        if key_old not in skip:
+            if queues.get(key_old[1]):
+                key_new = queues[key_old[1]].popleft()
+                if bom_old.part_columns.find_number(key_old[0]) != bom_new.part_columns.find_number(key_new[0]):
                     tracker.append_find_only(key_old, key_new)
-            except ValueError:
-                # Any errors occur means part was not found and needs review
-                tracker.not_found.add(key_old)
+            else:
+                # Part was not found and needs review
+                tracker.add_not_found(key_old)
     # Finds intersection aka parts that have not been changed in the newer revision
-    tracker.used = tracker.used + bom_new.intersect(bom_old)
+    tracker.used.update(bom_new.intersect(bom_old))
     # Run through old parts in exclusive_old to see if any needs to be updated
-    for part_old in exclusive_old:
-        try:
-            update_part(bom_old, part_old, bom_new, exclusive_new, tracker)
-        except KeyError:
-            # Any errors occur means part was not found and needs review
-            tracker.not_found.add(part_old)
+    if exclusive_old:
+        matrix = MatchMatrix(bom_old, exclusive_old, bom_new, exclusive_new, *thresholds, blocking=blocking)
+        if matching == 'assignment':
+            assign_parts(bom_old, bom_new, matrix, tracker)
+        else:
+            for row, part_old in enumerate(exclusive_old):
+                try:
+                    update_part(bom_old, part_old, bom_new, exclusive_new, tracker, matrix, row)
+                except KeyError:
+                    # Any errors occur means part was not found and needs review
+                    tracker.add_not_found(part_old)
     # Recursive formula for going down the BOM parents.
     # Updated parts will be assigned here to continue the update without needing
     # to redo the entire process
     for part_old, part_new in Bom.zip_intersect(bom_old, bom_new):
-        if bom_old.parent[f'{part_old[0]} {part_new[1]}']:
-            next_iter_old = Bom(bom_old.bom, bom_old.parent[f'{part_old[0]} {part_new[1]}'])
-            next_iter_new = Bom(bom_new.bom, bom_new.parent[f'{part_new[0]} {part_new[1]}'])
-            bom_old.parent[f'{part_old[0]} {part_new[1]}'] = Update(next_iter_old, next_iter_new, tracker)
+        key_old, key_new = bom_old.key(part_old[0], part_new[1]), bom_new.key(*part_new)
+        if bom_old.parent[key_old]:
+            branch = bom_old.parent[key_old]
+            if skip_same and bom_old.same_below(key_old, bom_new, key_new):
+                tracker.used.update(bom_new.subtree_parts(key_new))
+                continue
+            if memo is not None:
+                if memo.replay(branch, key_new, tracker):
+                    continue
+                start = memo.start(branch, tracker)
+            next_iter_old = bom_old.branch(branch)
+            next_iter_new = bom_new.branch(bom_new.parent[key_new])
+            bom_old.parent[key_old] = Update(next_iter_old, next_iter_new, tracker, matching, blocking, memo,
+                                             skip_same, thresholds)
+            if memo is not None:
+                memo.save(branch, key_new, tracker, start)
     return bom_old.parent
 
 
+class UpdateMemo:
+    """Update results of old branches, lets Rearrange rerun only the branches that changed
+
+    Note:
+        Rerunning Update on a branch that is the same as in its last run, against the same new branch,
+        gives the same result if the last run matched nothing. The parts it could not match either
+        scored too low or were used, and used parts are never freed. The logged find only matches
+        and not found parts of that run are replayed instead (see Tracker.log).
+        A branch is dirty when rearrange moved a part into or out of it or any branch below it, dirty
+        branches and branches with matches are always rerun.
+
+    Attributes:
+        results (dict): (id of the old branch, new key) to the old branch and its logged events, None if
+            the run had matches
+        dirty (set): ids of branches changed since their last run
+    """
+    def __init__(self):
+        self.results = {}
+        self.dirty = set()
+
+    def replay(self, branch: dict, key_new, tracker: Tracker):
+        """Replays the last run of the branch if it can be reused
+
+        :return: True if replayed, False if Update has to run
+        """
+        result = self.results.get((id(branch), key_new))
+        if result is None or result[1] is None or id(branch) in self.dirty:
+            return False
+        tracker.replay(result[1])
+        return True
+
+    def start(self, branch: dict, tracker: Tracker):
+        """Call before running Update on the branch, returns the log position to pass to save"""
+
+        self.dirty.discard(id(branch))
+        return len(tracker.log)
+
+    def save(self, branch: dict, key_new, tracker: Tracker, start: int):
+        """Keeps the events logged since start, only if none of them are matches"""
+
+        events = tracker.log[start:]
+        if any(event[0] in ('full', 'partial') for event in events):
+            events = None
+        # The branch is kept so its id is not reused while the result is stored
+        self.results[(id(branch), key_new)] = (branch, events)
+
+    def moved(self, tree: BomTree, touched: list):
+        """Marks the branches changed by rearrange and every branch above them dirty
+
+        Note:
+            The branches above are found from the tree after the moves, not from the branches Update ran
+            on, as parts can be moved into leaves and into branches skipped by Bom.same_below. A changed
+            branch that is no longer in the tree was moved or dropped, the branch it was taken out of is
+            also in touched.
+
+        :param tree: BomTree of the old bom
+        :param touched: (changed branch, branch inserted into it or None) from BomTree.move
+        """
+        for changed, inserted in touched:
+            self.dirty.add(id(changed))
+            key = tree.owners.get(id(changed))
+            if key is not None and key in tree:
+                self.dirty.update(id(tree.lookup(above)) for above in tree.path(key))
+
+
 def insert(obj: dict, key: str, new_key: str, new_value: str):
     """Recursive inserts the new value into dictionary
 
@@ -348,7 +1002,7 @@ def pop(obj: dict, key: str):
 
 
 def rearrange(obj: dict, old_key: str, new_key: str):
-    """Rearranges the given dictionary
+    """Rearranges the given dictionary, Rearrange uses BomTree.move which does the same without searching
 
     :param obj: the dictionary
     :param old_key: old key where the children will be taken
@@ -358,7 +1012,9 @@ def rearrange(obj: dict, old_key: str, new_key: str):
     return insert(obj, new_key, old_key, branch)
 
 
-def Rearrange(bom_old: Bom, bom_new: Bom, tracker: Tracker):
+def Rearrange(bom_old: Bom, bom_new: Bom, tracker: Tracker, matching: str = 'greedy', blocking: bool = False,
+              incremental: bool = True, skip_same: bool = True,
+              thresholds: tuple = (THRESHOLD_FULL, THRESHOLD_PARTIAL)):
     """Main method of compare.py. Basically calls Update multiple times.
 
     Called Rearrange because every time an update is identified, the newly updated parts may be found
@@ -369,9 +1025,19 @@ def Rearrange(bom_old: Bom, bom_new: Bom, tracker: Tracker):
         :param bom_old: Old bom as Bom obj
         :param bom_new: New bom as Bom obj
         :param tracker: Tracker obj to track recursion returns
+        :param matching: greedy or assignment, see Update
+        :param blocking: see Update
+        :param incremental: only rerun Update on the branches changed by the last pass, see UpdateMemo.
+            Gives the same result as rerunning everything
+        :param skip_same: skip branches that are the same in both boms, see Update. Gives the same result
+        :param thresholds: see Update
 
     :return: Nothing, will simply update the tracker object
     """
+    memo = UpdateMemo() if incremental else None
+    log = tracker.log
+    if bom_old.tree is None:
+        bom_old.tree = BomTree(bom_old.parent)
     # Using len -1 so to not trigger the not found condition right away
     # Will keep running rearrange until the length of not_found list remains constant
     # which signals that there are no more updates to be found
@@ -380,23 +1046,31 @@ def Rearrange(bom_old: Bom, bom_new: Bom, tracker: Tracker):
         # Previous length and rerun the Update function
         prev_len_mia = len(tracker.not_found)
         tracker.reset_not_found()
-        Update(bom_old, bom_new, tracker)
+        if memo is not None:
+            # Positions saved by the memo are only valid within one pass
+            tracker.log = []
+        Update(bom_old, bom_new, tracker, matching, blocking, memo, skip_same, thresholds)
+        touched = [] if memo is not None else None
         # Rearranging the Bom
         for part in tracker.not_found:
-            if part[1] in bom_new.bom['Name'].values:
+            if bom_new.part_columns.has_name(part[1]):
                 try:
-                    parent_new = bom_new.immediate_parent(
-                        bom_new.bom.loc[bom_new.bom['Name'] == part[1]].index[0]
-                    )
-                    if parent_new[1] in bom_old.bom['Name'].values:
-                        parent_old_index = bom_new.bom.loc[bom_new.bom['Name'] == part[1]].index[0]
-                        print(f'{part[0]} {part[1]} has been rearranged to be under {parent_old_index} {parent_new[1]}')
-                        rearrange(bom_old.parent, f'{part[0]} {part[1]}', f'{parent_old_index} {parent_new[1]}')
+                    parent_new = bom_new.immediate_parent(bom_new.part_columns.first_row(part[1]))
+                    if bom_old.part_columns.has_name(parent_new[1]):
+                        parent_old_index = bom_new.part_columns.first_row(part[1])
+                        if tracker.emits(Rearranged):
+                            tracker.emit(Rearranged(part, (int(parent_old_index), parent_new[1])))
+                        bom_old.tree.move(bom_old.key(*part), bom_old.key(parent_old_index, parent_new[1]),
+                                          touched)
                 except TypeError:
                     continue
+        if memo is not None:
+            memo.moved(bom_old.tree, touched)
+    tracker.log = log
     # Displays output message for user
-    for part in tracker.not_found:
-        print(f'{part[1]} was not found')
+    if tracker.emits(NotFound):
+        for part in tracker.not_found:
+            tracker.emit(NotFound(part))
 
 
 if __name__ == '__main__':
@@ -413,5 +1087,6 @@ if __name__ == '__main__':
     bom_new = Bom(new_bom, new_tree)
 
     tracker = Tracker()
+    tracker.events = print_event
     Rearrange(bom_old, bom_new, tracker)
     print(tracker.not_found_to_df())
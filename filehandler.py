@@ -145,9 +145,11 @@ class Illustration:
         scan_dir (path, str): Where documents to be scanned are saved (in format refereced in get_illustrations)
                               This path is used in conjuncture with DocumentCollector when downloading.
         ccl_dir (path, str): where the documents to be scanned are saved (in format of CSA submission package)
+        fast_parse (bool): Parse the CCL with the fast xml reader, see Parser
     """
-    def __init__(self, ccl: str, save_dir: str, processes: int = 1):
+    def __init__(self, ccl: str, save_dir: str, processes: int = 1, fast_parse: bool = False):
         self.ccl = ccl
+        self.fast_parse = fast_parse
         # self.document = Document(ccl)
         # self.table = self.document.tables[0]
         self.processes = processes
@@ -159,7 +161,7 @@ class Illustration:
     def get_filtered(self):
         """Converts word CCL to filtered"""
 
-        self.filtered = Parser(self.ccl).filter()
+        self.filtered = Parser(self.ccl, fast=self.fast_parse).filter()
 
     def _multi_identify_scan(self, pn: str):
         """Scans the scandir directory for illustrations
@@ -350,13 +352,15 @@ class DocumentCollector:
         headless (bool): Headless mode True/ False for selenium
         temp_dir (path): Temporary directory where the files are saved before rearranging
         progress_val (int): Used with progress bar
+        fast_parse (bool): Parse the CCL with the fast xml reader, see Parser
     """
     def __init__(self, username: str,
                  password: str,
                  ccl: str,
                  save_dir: str,
                  processes: int = 1,
-                 headless: bool = True):
+                 headless: bool = True,
+                 fast_parse: bool = False):
         self.username = username
         self.password = password
         self.ccl = ccl
@@ -367,6 +371,7 @@ class DocumentCollector:
         self.headless = headless
         self.temp_dir = None
         self.progress_val = 0
+        self.fast_parse = fast_parse
 
     def create_temp_dir(self):
         """Create temporary directory to save files"""
@@ -380,7 +385,7 @@ class DocumentCollector:
     def get_filtered(self):
         """Creates the filtered CCL if not given"""
 
-        self.filtered = Parser(self.ccl).filter()
+        self.filtered = Parser(self.ccl, fast=self.fast_parse).filter()
 
     def _multidownload(self, pn: str):
         """Multiprocess downloading
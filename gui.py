@@ -1191,8 +1191,8 @@ class ROHSCompare(tk.Frame):
         """Logic for bom comparison"""
 
         # Read in the paths
-        a_avl = self.read_avl(a_avl, 0)
-        b_avl = self.read_avl(b_avl, 0)
+        a_avl = self.read_avl(a_avl)
+        b_avl = self.read_avl(b_avl)
         a_pns, b_pns = set(a_avl['Name']), set(b_avl['Name'])
         exclusive = {pn for pn in a_pns if pn not in b_pns}
         df_exclusive = pd.DataFrame()
@@ -1220,19 +1220,10 @@ class ROHSCompare(tk.Frame):
         self.save_as(sf)
 
     @staticmethod
-    def read_avl(path, skiprow):
-        """Read avl method to figure out header row"""
+    def read_avl(path, skiprow=0):
+        """Read avl method to figure out header row, same as CCL.read_avl"""
 
-        df = pd.read_csv(path, skiprows=skiprow)
-        try:
-            df['Name']
-        except KeyError:
-            skiprow += 1
-            if skiprow < 10:
-                df = CCL.read_avl(path, skiprow)
-            else:
-                raise TypeError('File is in wrong format')
-        return df
+        return CCL.read_avl(path, skiprow)
 
     def save_as(self, sf):
         filename = filedialog.asksaveasfilename(initialdir=self.root.cache_dir,
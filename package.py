@@ -7,15 +7,24 @@ Author: Steven Fu
 
 
 import pandas as pd
+import numpy as np
 from docx.api import Document
+from lxml import etree
 import re
 
 from zipfile import ZipFile
 import json
 import copy
+import io
+import hashlib
 
-import shutil
 import os
+import sys
+
+from cache import DiskCache, default_cache, file_hash
+
+# Increase when the output of Parser.filter changes so old cached results are not used
+PARSER_VERSION = 1
 
 
 class Parser:
@@ -31,16 +40,30 @@ class Parser:
 
     Attrs:
         word_doc: the path to the word document
-        document: the raw word document that was read
+        document: the raw word document that was read, only read when first used
         table: the table object within the word document
+        fast: read the table straight from the docx xml (read_docx_table) instead of python-docx
+        cache: DiskCache for filter results, None for the default cache and False to not cache
 
     Functions:
         to_dataframe: Convert word directly to a dataframe
         filter: Will filter out the important information from the table
     """
-    def __init__(self, word_doc):
-        self.document = Document(word_doc)
-        self.table = self.document.tables[0]
+    def __init__(self, word_doc, fast: bool = False, cache: DiskCache = None):
+        self.word_doc = word_doc
+        self.fast = fast
+        self.cache = default_cache() if cache is None else cache
+        self._document = None
+
+    @property
+    def document(self):
+        if self._document is None:
+            self._document = Document(self.word_doc)
+        return self._document
+
+    @property
+    def table(self):
+        return self.document.tables[0]
 
     def to_dataframe(self):
         """Convert word directly to dataframe with no regex/ filtering
@@ -52,6 +75,8 @@ class Parser:
         :return dataframe with columns: columns and data of the raw table document
         """
         columns = ['pn', 'desc', 'vendor', 'model', 'technical', 'standards', 'marks', 'bold']
+        if self.fast:
+            return pd.DataFrame(data=self._xml_rows(), columns=columns)
         to_df = []
         for row in self.table.rows:
             temp = [cell.text.strip() for cell in row.cells]
@@ -62,15 +87,52 @@ class Parser:
             to_df.append(temp + [bold])
         return pd.DataFrame(data=to_df, columns=columns)
 
-    def filter(self):
+    def _xml_rows(self):
+        """Same rows as to_dataframe but read using read_docx_table"""
+
+        to_df = []
+        for row in read_docx_table(self.word_doc):
+            temp = [text.strip() for text, runs in row]
+            try:
+                bold = row[0][1][0]
+            except IndexError:  # Note when this happens it means that the text was a hyper link or not plain text
+                print(f'Error occurred when parsing pn after {to_df[len(to_df)-1][0]}')
+            to_df.append(temp + [bold])
+        return to_df
+
+    def filter(self, vectorized: bool = True):
         """Filter the inputted table into useful data only
 
         Note:
-            Nums are ints where possible, the rest are string. All regex is done by the
-            static method _re_get_cols. Please see for more information.
+            Nums are ints where possible, the rest are string. All regex is done column wise
+            by _filter_columns, or row by row by the static method _re_get_cols when vectorized
+            is False. Please see for more information.
+            The result is cached by the hash of the docx, a cached CCL is not read again.
+
+        :param vectorized: use the column wise regex and duplicate removal, same result as row by row
 
         :return DataFrame with columns: pn, desc, fn, assy, sch, bold.
         """
+        key = self._cache_key()
+        if key is not None:
+            filtered = self.cache.get(key)
+            if filtered is not None:
+                return filtered
+        filtered = self._filter(vectorized)
+        if key is not None:
+            self.cache.put(key, filtered)
+        return filtered
+
+    def _cache_key(self):
+        """Cache key from the docx contents, None if not cached (cache off or not a file path)"""
+
+        if self.cache is False or not isinstance(self.word_doc, (str, os.PathLike)):
+            return None
+        return f'filter {PARSER_VERSION} {file_hash(self.word_doc)}'
+
+    def _filter(self, vectorized: bool):
+        """Filter without the cache, see filter"""
+
         def remove_duplicates(df):
             """Will only remove duplicates that are touching
 
@@ -87,10 +149,72 @@ class Parser:
 
         columns = ['pn', 'desc', 'fn', 'dnums', 'illustration data']
         df = self.to_dataframe()
-        data = [Parser._re_getcols(row) for index, row in df.iterrows()]
+        if vectorized:
+            data = Parser._filter_columns(df)
+        else:
+            data = [Parser._re_getcols(row) for index, row in df.iterrows()]
         filtered = pd.concat([pd.DataFrame(data, columns=columns), df['bold']], axis=1)
+        if vectorized:
+            return Parser._remove_adjacent_duplicates(filtered)
         return remove_duplicates(filtered)
 
+    @staticmethod
+    def _filter_columns(df: pd.DataFrame):
+        """Column wise version of _re_getcols for the whole to_dataframe output
+
+        :return list of rows in the same format as _re_getcols, so the DataFrame is built the same way
+        """
+        data = np.full((len(df.index), 5), None, dtype=object)
+        # Part number, first group of digits
+        pn = df['pn'].str.extract(r'(\d+)', expand=False)
+        found = pn.notna().to_numpy()
+        data[found, 0] = pn[found].map(int).to_numpy()
+        # Description and function number, see _re_fn_name
+        desc = df['desc']
+        fn = desc.str.extract(r'\(#(\d+)\)', expand=False)
+        found = fn.notna().to_numpy()
+        # Every (#N) with N being the first function number is removed, the backreference checks
+        # each match against N which is appended after a \x1f separator
+        cleaned = (desc[found].astype(object) + '\x1f' + fn[found]) \
+            .str.replace(r'(?s)\(#(\d+)\)(?=.*\x1f\1$)', '', regex=True) \
+            .str.split('\x1f').str[0] \
+            .str.strip().str.replace('\n', '', regex=False) \
+            .str.replace(r'([^\s\w]|_)+', '', regex=True)
+        data[:, 1] = desc.to_numpy()
+        data[found, 1] = cleaned.to_numpy()
+        data[found, 2] = fn[found].map(int).to_numpy()
+        # Document numbers, see _re_doc_num
+        dnums = df['technical'].str.findall(r'D\d+')
+        found = (dnums.str.len() > 0).to_numpy()
+        data[found, 3] = dnums[found].to_numpy()
+        # Illustration data, see illustration_dict
+        technical = df['technical'].str.replace(r'\W+', '', regex=True)
+        found = technical.str.contains(r'refertoill.', case=False, regex=True).to_numpy()
+        ills = technical[found].str.findall(r'(\d+)(assy|sch)(D\d+)', flags=re.IGNORECASE)
+        data[found, 4] = ills.map(_illustration_records).to_numpy()
+        return data.tolist()
+
+    @staticmethod
+    def _remove_adjacent_duplicates(df: pd.DataFrame):
+        """Vectorized remove_duplicates, compares every row with the next one using a shifted frame
+
+        Note:
+            remove_duplicates stops early by one row for every row it drops (the length of the frame
+            shrinks while the pointers do not), this is kept so both return the same frame.
+        """
+        size = len(df.index)
+        if size < 2:
+            return df.reset_index(drop=True)
+        after = df.shift(-1)
+        same = np.ones(size, dtype=bool)
+        for column in df.columns:
+            current, following = df[column], after[column]
+            same &= ((current == following) | (current.isna() & following.isna())).to_numpy()
+        same[-1] = False
+        dropped_before = np.cumsum(same) - same
+        compared = np.arange(1, size + 1) + dropped_before < size
+        return df[~(same & compared)].reset_index(drop=True)
+
     @staticmethod
     def _re_getcols(series: pd.Series):
         """Use regex to filter out data from series"""
@@ -106,6 +230,93 @@ class Parser:
         return output
 
 
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+
+def _w(tag):
+    """Qualified tag name in the word xml namespace"""
+
+    return f'{{{W_NS}}}{tag}'
+
+
+def read_docx_table(word_doc):
+    """Reads the first table of a docx directly from word/document.xml
+
+    Note:
+        Streams the xml with iterparse and stops at the end of the first table in the body,
+        everything before it is cleared as it is read. Merged cells are repeated the same way
+        python-docx row.cells does, horizontally merged cells are repeated and vertically merged
+        cells are the cell above. Only runs directly in a paragraph are read (no hyperlinks).
+
+    :param word_doc: path or file object of the docx
+    :return list of rows, each row a list of (text, bold) per column where bold is a list of the
+            bold flags of the runs in the first paragraph of the cell
+    """
+    with ZipFile(word_doc) as docx, docx.open('word/document.xml') as xml:
+        for event, elem in etree.iterparse(xml, events=('end',), tag=(_w('p'), _w('tbl'))):
+            if elem.getparent().tag != _w('body'):
+                continue
+            if elem.tag == _w('tbl'):
+                return _table_rows(elem)
+            # Body paragraphs before the table are not needed
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    raise IndexError('No table found in the word document')
+
+
+def _table_rows(tbl):
+    """Cells of a w:tbl element in the layout of python-docx table.rows[i].cells"""
+
+    col_count = len(tbl.findall(f'{_w("tblGrid")}/{_w("gridCol")}'))
+    cells, row_count = [], 0
+    for tr in tbl.iterchildren(_w('tr')):
+        row_count += 1
+        for tc in tr.iterchildren(_w('tc')):
+            span = tc.find(f'{_w("tcPr")}/{_w("gridSpan")}')
+            span = int(span.get(_w('val'))) if span is not None else 1
+            merge = tc.find(f'{_w("tcPr")}/{_w("vMerge")}')
+            merge = merge.get(_w('val'), 'continue') if merge is not None else None
+            for grid_span_idx in range(span):
+                if merge == 'continue':
+                    cells.append(cells[-col_count])
+                elif grid_span_idx > 0:
+                    cells.append(cells[-1])
+                else:
+                    cells.append(_cell_data(tc))
+    return [cells[row * col_count:(row + 1) * col_count] for row in range(row_count)]
+
+
+def _cell_data(tc):
+    """Text of the cell and the bold flags of the runs in its first paragraph"""
+
+    paragraphs = [p.findall(_w('r')) for p in tc.iterchildren(_w('p'))]
+    text = '\n'.join(''.join(_run_text(r) for r in runs) for runs in paragraphs)
+    bold = [_run_bold(r) for r in paragraphs[0]] if paragraphs else []
+    return text, bold
+
+
+def _run_text(r):
+    """Text of a w:r element, same as python-docx run.text"""
+
+    text = ''
+    for child in r:
+        if child.tag == _w('t'):
+            text += child.text if child.text is not None else ''
+        elif child.tag == _w('tab'):
+            text += '\t'
+        elif child.tag in (_w('br'), _w('cr')):
+            text += '\n'
+    return text
+
+
+def _run_bold(r):
+    """True if the run is set to bold directly, styles are ignored same as python-docx run.bold"""
+
+    b = r.find(f'{_w("rPr")}/{_w("b")}')
+    return b is not None and b.get(_w('val'), 'true').lower() not in ('0', 'false', 'off')
+
+
 def illustration_dict(string):
     """Creates a dictionary of all important data regarding illustrations
 
@@ -113,11 +324,13 @@ def illustration_dict(string):
     """
     string = re.sub(r'\W+', '', string).replace(' ', '')
     if re.findall(r'refertoill.', string, re.IGNORECASE):
-        ill_dict = [
-            {'num': result[0], 'type': result[1], 'dnum': result[2]}
-            for result in re.findall(r'(\d+)(assy|sch)(D\d+)', string, re.IGNORECASE)
-        ]
-        return ill_dict
+        return _illustration_records(re.findall(r'(\d+)(assy|sch)(D\d+)', string, re.IGNORECASE))
+
+
+def _illustration_records(results):
+    """Formats the regex results of illustration_dict into its list of dictionaries"""
+
+    return [{'num': result[0], 'type': result[1], 'dnum': result[2]} for result in results]
 
 
 def _re_pn(string):
@@ -162,24 +375,32 @@ class Parent:
         lowest: the lowest child (highest level) in the bom
         flat: the flattened dictionary
         tree: a multi level dictionary
+        level_index: LevelIndex of the bom, parent/ depth/ subtree arrays (see build_index)
+        builder: 'stack' for the single pass builder, 'flat' for the original flat + replace builder
     """
-    def __init__(self, avl_bom):
+    BUILDERS = ('stack', 'flat')
+
+    def __init__(self, avl_bom, builder: str = 'stack'):
+        if builder not in self.BUILDERS:
+            raise ValueError(f'Invalid builder, needs to be one of {self.BUILDERS}')
         self.avl_bom = avl_bom
+        self.builder = builder
         self.set_bom()
         self.lowest = self.bom['Level'].max()
         self.flat = {}
         self.tree = {}
+        self.level_index = None
 
     def set_bom(self):
         """Sets self.bom depending if given a dataframe or path"""
 
+        if isinstance(self.avl_bom, pd.DataFrame):
+            self.bom = self.avl_bom
+            return
         try:
             self.bom = pd.read_csv(self.avl_bom)
-        except ValueError:
-            if isinstance(self.avl_bom, pd.DataFrame):
-                self.bom = self.avl_bom
-            else:
-                raise ValueError('Invalid AVL Bom input, needs to be path or dataframe')
+        except (ValueError, TypeError):
+            raise ValueError('Invalid AVL Bom input, needs to be path or dataframe')
 
     def build_flat(self):
         """Builds a flat dictionary with parent + child as keys
@@ -208,9 +429,69 @@ class Parent:
             child += 1
         return self.flat
 
+    def build_stack(self):
+        """Builds both the flat dictionary and the tree in a single pass over the bom
+
+        Note:
+            Keeps the most recent row of every level on a stack, a row is always the child of the
+            latest row one level above it. This is the same rule build_flat uses but without rescanning
+            the bom for every level. A row with no row one level above it goes under the parent build_flat
+            carries over from the previous level, the last row two levels above it in the bom (or three
+            levels if there is none, and so on). These rows come after the other children of that parent.
+            Rows with no parent at all are placed at the top of the tree after the level 1 parts, the same
+            way build_tree places keys it could not insert, or dropped if they are at the lowest level
+            like build_flat does.
+
+        :return dictionary with same list level as Enovia BOM, flat is also set
+        """
+        # Also skips NaN levels since all comparisons are false, build_flat only places whole levels
+        rows = [(level, f'{idx} {name}', {})
+                for idx, level, name in zip(self.bom.index, self.bom['Level'], self.bom['Name'])
+                if 1 <= level <= self.lowest and level % 1 == 0]
+        last = {level: (level, key, node) for level, key, node in rows if level < self.lowest}
+
+        def carried(level):
+            for above in range(int(level) - 2, 0, -1):
+                if above in last:
+                    return last[above]
+            return None
+
+        # Only parents (levels below the lowest) are keys of flat, kept per level to match its order
+        flat_levels, orphans, gapped = {}, {}, []
+        stack = {}  # level: (key, node) of the latest row at that level
+        tree = {}
+        for level, key, node in rows:
+            if level < self.lowest:
+                flat_levels.setdefault(level, {})[key] = {}
+            if level - 1 in stack:
+                parent_key, parent_node = stack[level - 1]
+                parent_node[key] = node
+                flat_levels[level - 1][parent_key][key] = {}
+            elif level > 1 and carried(level) is not None:
+                gapped.append((level, key, node))
+            elif level == 1 and level < self.lowest:
+                tree[key] = node
+            elif level < self.lowest:
+                orphans.setdefault(level, {})[key] = node
+            if level < self.lowest:
+                stack[level] = (key, node)
+        # build_flat adds them one level at a time, after the children found on earlier levels
+        for level, key, node in sorted(gapped, key=lambda row: row[0]):
+            parent_level, parent_key, parent_node = carried(level)
+            parent_node[key] = node
+            flat_levels[parent_level][parent_key][key] = {}
+        for level in sorted(orphans):
+            tree.update(orphans[level])
+        self.flat = {key: value for level in sorted(flat_levels) for key, value in flat_levels[level].items()}
+        self.tree = tree
+        return self.tree
+
     def build_tree(self):
         """Returns a structured tree using the flattened one
 
+        Note:
+            Uses build_stack unless the builder is set to 'flat'. Both return the same tree.
+
         Using the flat dictionary, it will reassemble it using the idea that there will be repeat
         keys. The child will now become the parent of the individual parent. For example, if
         12:{1,2,3,4}, and 15:{10, 11, 12, 13, 14} --> 15:{10, 11, 12:{1,2,3,4}, 13, 14}.
@@ -220,27 +501,45 @@ class Parent:
 
         :return dictionary with same list level as Enovia BOM
         """
+        if self.builder == 'stack':
+            return self.build_stack()
         if not self.flat:
             self.build_flat()
         # Creates a copy of the flat attribute for popping
         copy_flat = copy.deepcopy(self.flat)
+        # Keeps track of where every key is, see BomTree
+        tree = BomTree(self.tree)
         while copy_flat:
-            key = list(copy_flat)[0]
-            # If empty, ie the first run, will set first key as first parent
-            # This is ok because the flattened tree is in the same order as the bom.
-            if not self.tree:
-                self.tree[key] = copy_flat.pop(key)
-                continue
+            key = next(iter(copy_flat))
             data = copy_flat.pop(key)
-            Parent.replace_item(self.tree, key, data)
-            # Checks if an item was inserted, if not the data will be appended to end
-            if not Parent.exists(self.tree, key):
-                self.tree[key] = data
+            # If the key was already added as a child its children are filled in, if not the data will
+            # be appended to end. The first key is always a first parent since the flattened tree
+            # is in the same order as the bom.
+            if key in tree:
+                tree.replace(key, data)
+            else:
+                tree.add(key, data)
         return self.tree
 
+    def build_index(self):
+        """Builds the LevelIndex of the bom once, used for parent and subtree lookups
+
+        :return LevelIndex of the bom, also assigned to level_index
+        """
+        if self.level_index is None:
+            self.level_index = LevelIndex(self.bom['Level'], self.bom.index)
+        return self.level_index
+
+    def build_compact(self):
+        """Builds the tree as a CompactTree, the array backed version of build_tree
+
+        :return CompactTree with the same structure as build_tree
+        """
+        return CompactTree(self.build_index(), self.bom['Name'])
+
     @staticmethod
     def replace_item(obj, key, replace_value):
-        """Recursively replaces item/ inserts item"""
+        """Recursively replaces item/ inserts item, see BomTree.replace for the indexed version"""
 
         for k, v in obj.items():
             if v:
@@ -260,13 +559,487 @@ class Parent:
                 return True
 
 
-def BuildPackage(save_path: os.path, word_doc: os.path, avl_bom: os.path):
+class BomTree:
+    """Nested dictionary tree with a key to parent map
+
+    Note:
+        The tree is the same nested dictionary as Parent.tree and is changed in place, so code that
+        reads the dictionaries directly keeps working. Every key is kept with the dictionary it is
+        in and every dictionary with the key it belongs to, so lookup, detach and move only walk
+        the path to the key instead of the whole tree. Keys are expected to be unique, which they
+        are since they start with the bom index.
+        All changes have to go through the BomTree, otherwise the maps go out of date.
+
+    Attributes:
+        tree: the nested dictionary
+        parents: key to the dictionary that holds it
+        owners: id of a dictionary to the key it is the value of, the top level is not included
+        changed: keys that had a key moved into or out of somewhere below them by detach or move
+    """
+    def __init__(self, tree: dict = None):
+        self.tree = {} if tree is None else tree
+        self.parents = {}
+        self.owners = {}
+        self.changed = set()
+        self._index(self.tree)
+
+    def _index(self, node: dict):
+        """Adds every key below node to the maps"""
+
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for key, value in node.items():
+                self.parents[key] = node
+                if isinstance(value, dict):
+                    self.owners[id(value)] = key
+                    stack.append(value)
+
+    def _unindex(self, key, value):
+        """Removes the key and every key below it from the maps"""
+
+        self.parents.pop(key, None)
+        stack = [value]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                self.owners.pop(id(node), None)
+                for child, child_value in node.items():
+                    self.parents.pop(child, None)
+                    stack.append(child_value)
+
+    def __contains__(self, key):
+        return key in self.parents
+
+    def lookup(self, key):
+        """Value (children) of the key, KeyError if not in the tree"""
+
+        return self.parents[key][key]
+
+    def parent(self, key):
+        """Key of the parent, None for keys at the top level"""
+
+        return self.owners.get(id(self.parents[key]))
+
+    def path(self, key):
+        """Keys from the top level down to key"""
+
+        path = [key]
+        while True:
+            key = self.parent(key)
+            if key is None:
+                return path[::-1]
+            path.append(key)
+
+    def add(self, key, value, parent_key=None):
+        """Adds the key with its value under parent_key, at the top level if parent_key is None"""
+
+        node = self.tree if parent_key is None else self.lookup(parent_key)
+        node[key] = value
+        self.parents[key] = node
+        if isinstance(value, dict):
+            self.owners[id(value)] = key
+            self._index(value)
+
+    def replace(self, key, value):
+        """Replaces the value of a key already in the tree"""
+
+        node = self.parents[key]
+        self._unindex(key, node[key])
+        self.add(key, value, self.owners.get(id(node)))
+
+    def rename(self, key, new_key):
+        """Renames the key, it is moved to the end of its dictionary like dict[new_key] = dict.pop(key)"""
+
+        if key in self.changed:
+            self.changed.discard(key)
+            self.changed.add(new_key)
+        node = self.parents.pop(key)
+        node[new_key] = value = node.pop(key)
+        self.parents[new_key] = node
+        if isinstance(value, dict):
+            self.owners[id(value)] = new_key
+
+    def detach(self, key, touched: list = None):
+        """Removes the key and returns its value, None if not in the tree
+
+        :param touched: if given, (dictionary removed from, None) is appended
+        """
+        if key not in self.parents:
+            return None
+        self.changed.update(self.path(key)[:-1])
+        node = self.parents[key]
+        value = node.pop(key)
+        self._unindex(key, value)
+        if touched is not None:
+            touched.append((node, None))
+        return value
+
+    def move(self, key, new_parent, touched: list = None):
+        """Moves the key and everything below it under new_parent
+
+        Note:
+            Same result as compare.rearrange, if key is not in the tree it is added under new_parent with
+            a value of None and if new_parent is not in the tree the key is only removed.
+
+        :param touched: if given, (dictionary removed from, None) and (dictionary inserted into, value) are appended
+        """
+        value = self.detach(key, touched)
+        if new_parent in self.parents:
+            self.changed.update(self.path(new_parent))
+            node = self.lookup(new_parent)
+            node[key] = value
+            self.parents[key] = node
+            if isinstance(value, dict):
+                self.owners[id(value)] = key
+                self._index(value)
+            if touched is not None:
+                touched.append((node, value))
+        return self.tree
+
+
+class LevelIndex:
+    """Parent, depth and subtree arrays decoded from the Level column
+
+    Note:
+        All arrays are positional (0 to len(bom) - 1), the lookup methods take and return
+        index labels. The parent of a row is the latest row above it that is one level
+        higher, the same rule used by Parent.build_flat. Rows without a parent are -1.
+
+    Attributes:
+        labels: index labels of the bom
+        level: the Level column as an array
+        parent_idx: position of the immediate parent of every row, -1 if none
+        depth: number of ancestors of every row
+        subtree_end: position after the last descendant of every row (exclusive)
+    """
+    def __init__(self, levels, labels=None):
+        self.labels = pd.RangeIndex(len(levels)) if labels is None else pd.Index(labels)
+        self.level = np.asarray(levels, dtype=float)
+        valid = ~np.isnan(self.level)
+        size = len(self.level)
+        self.parent_idx = np.full(size, -1, dtype=np.int64)
+        self.depth = np.zeros(size, dtype=np.int64)
+        self.subtree_end = np.arange(1, size + 1, dtype=np.int64)
+
+        values = np.unique(self.level[valid])
+        rows_by_level = {value: np.flatnonzero(valid & (self.level == value)) for value in values}
+        # Parents: for every level, search the rows one level higher for the closest one above
+        for value, rows in rows_by_level.items():
+            above = rows_by_level.get(value - 1)
+            if above is None:
+                continue
+            pos = np.searchsorted(above, rows) - 1
+            found = pos >= 0
+            self.parent_idx[rows[found]] = above[pos[found]]
+        # Depth top down, subtree ends bottom up, one vectorized step per level
+        for value in values:
+            rows = rows_by_level[value]
+            parents = self.parent_idx[rows]
+            self.depth[rows] = np.where(parents >= 0, self.depth[parents] + 1, 0)
+        for value in values[::-1]:
+            rows = rows_by_level[value]
+            rows = rows[self.parent_idx[rows] >= 0]
+            np.maximum.at(self.subtree_end, self.parent_idx[rows], self.subtree_end[rows])
+
+    def __len__(self):
+        return len(self.level)
+
+    def position(self, label):
+        """Converts an index label into its position"""
+
+        return self.labels.get_loc(label)
+
+    def immediate_parent(self, label):
+        """Index label of the immediate parent, None if there is no parent"""
+
+        parent = self.parent_idx[self.position(label)]
+        return self.labels[parent] if parent >= 0 else None
+
+    def ancestors(self, label):
+        """Index labels of all parents, starting from the immediate parent"""
+
+        output = []
+        parent = self.parent_idx[self.position(label)]
+        while parent >= 0:
+            output.append(self.labels[parent])
+            parent = self.parent_idx[parent]
+        return output
+
+    def subtree(self, label):
+        """Index labels of every row below the given label (not including itself)
+
+        Note:
+            The rows up to subtree_end can also have rows with no parent between them, these are
+            left out.
+        """
+        pos = self.position(label)
+        end = self.subtree_end[pos]
+        parents = self.parent_idx[pos + 1:end]
+        if (parents >= pos).all():
+            return self.labels[pos + 1:end]
+        below = np.zeros(end - pos, dtype=bool)
+        below[0] = True
+        for row, parent in enumerate(parents.tolist(), 1):
+            below[row] = parent >= pos and below[parent - pos]
+        return self.labels[pos + np.flatnonzero(below[1:]) + 1]
+
+    def children(self, label):
+        """Index labels of the direct children of the given label"""
+
+        pos = self.position(label)
+        below = self.parent_idx[pos + 1:self.subtree_end[pos]]
+        return self.labels[np.flatnonzero(below == pos) + pos + 1]
+
+    def carried_parent_idx(self):
+        """Position of the parent Parent.build_flat carries over to rows with no parent, -1 if none
+
+        Note:
+            build_flat places a row with no row one level above it under the last row two levels above
+            it in the bom, or three levels if there is none, and so on. That row can be below it in the
+            bom, so it is not its parent in parent_idx or subtree.
+        """
+        carried = np.full(len(self), -1, dtype=np.int64)
+        with np.errstate(invalid='ignore'):
+            gapped = (self.level > 1) & (self.level % 1 == 0) & (self.parent_idx < 0)
+        for value in np.unique(self.level[gapped]):
+            for above in range(int(value) - 2, 0, -1):
+                rows = np.flatnonzero(self.level == above)
+                if len(rows):
+                    carried[gapped & (self.level == value)] = rows[-1]
+                    break
+        return carried
+
+    def fingerprints(self, columns, excluded=None):
+        """Merkle hash of the rows below every row
+
+        Note:
+            The hash of a row covers the values and hashes of its children in order, so two rows have the
+            same hash when everything below them is the same. The values of the row itself are not included.
+            Rows with no children all have the same hash. Rows that get rows carried over under them in
+            the tree (see carried_parent_idx) get None, along with every row above them.
+
+        :param columns: list of column arrays, the values that are hashed
+        :param excluded: bool array, rows that should never be equal to another row. Every row above an
+            excluded row gets None instead of a hash
+
+        :return: list with the hash (bytes) or None of every row
+        """
+        size = len(self)
+        values = [repr(row).encode() for row in zip(*[[str(value) for value in column] for column in columns])]
+        excluded = [False] * size if excluded is None else np.asarray(excluded, dtype=bool).tolist()
+        children = [[] for _ in range(size)]
+        for row, parent in enumerate(self.parent_idx.tolist()):
+            if parent >= 0:
+                children[parent].append(row)
+        carried = set(self.carried_parent_idx().tolist())
+        hashes = [None] * size
+        # Children are always below their parent, so going up the bom every child is done first
+        for row in range(size - 1, -1, -1):
+            digest = hashlib.blake2b(digest_size=16)
+            for child in children[row]:
+                if excluded[child] or hashes[child] is None:
+                    digest = None
+                    break
+                digest.update(values[child])
+                digest.update(hashes[child])
+            hashes[row] = None if digest is None or row in carried else digest.digest()
+        return hashes
+
+
+class CompactTree:
+    """Array backed tree with integer node ids instead of "idx pn" string keys
+
+    Note:
+        Node ids are the row positions of the bom. Children are stored CSR style, the children
+        of a node are child_ids[child_ptr[node]:child_ptr[node + 1]] in bom order. Part numbers
+        are stored once in pns and referenced by code. The structure is the same as Parent.build_tree,
+        to_dict converts it back into the nested dictionary. Rows with no parent one level above them
+        go under the parent Parent.build_flat carries over (see Parent.build_stack), so a child is not
+        always below its parent in the bom, but its level is always higher.
+
+    Attributes:
+        labels: index labels of the bom
+        pn_codes: part number code of every node
+        pns: interned part numbers, pns[pn_codes[node]] is the part number of node
+        child_ptr: CSR offsets into child_ids for every node
+        child_ids: node ids of all children, grouped by parent
+        roots: node ids at the top of the tree
+        level: level of every node
+    """
+    ARRAYS = ('labels', 'level', 'pn_codes', 'pns', 'child_ptr', 'child_ids', 'roots')
+
+    def __init__(self, level_index: LevelIndex, names):
+        self.labels = level_index.labels
+        self.level = level_index.level
+        codes, uniques = pd.factorize(pd.Series(names).astype(str))
+        self.pn_codes = codes.astype(np.int32)
+        self.pns = [sys.intern(pn) for pn in uniques]
+
+        level = level_index.level
+        lowest = np.nanmax(level) if len(level) else 0
+        # Same rows as Parent.build_tree, whole levels 1 to lowest with level 1 parents at the top
+        with np.errstate(invalid='ignore'):
+            included = (level >= 1) & (level <= lowest) & (level % 1 == 0)
+        parent_idx = np.where(included & (level > 1), level_index.parent_idx, -1)
+        # Rows with no parent one level above them get the parent carried over by Parent.build_flat
+        carried = level_index.carried_parent_idx()
+        parent_idx = np.where(carried >= 0, carried, parent_idx)
+        children = np.flatnonzero(parent_idx >= 0)
+        counts = np.bincount(parent_idx[children], minlength=len(level))
+        self.child_ptr = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+        # Children by level then bom order, carried over children come after the others
+        order = np.lexsort((children, level[children], parent_idx[children]))
+        self.child_ids = children[order].astype(np.int32)
+        # Rows without parents go to the top after the level 1 rows, lowest level orphans are dropped
+        roots = np.flatnonzero(included & (parent_idx < 0) & (level < lowest))
+        self.roots = roots[np.lexsort((roots, level[roots]))].astype(np.int32)
+
+    def __len__(self):
+        return len(self.pn_codes)
+
+    @property
+    def nbytes(self):
+        """Approximate memory used by the tree in bytes"""
+
+        arrays = self.pn_codes.nbytes + self.child_ptr.nbytes + self.child_ids.nbytes + self.roots.nbytes
+        return arrays + sum(sys.getsizeof(pn) for pn in self.pns)
+
+    def children(self, node: int):
+        """Node ids of the children of node"""
+
+        return self.child_ids[self.child_ptr[node]:self.child_ptr[node + 1]]
+
+    def pn(self, node: int):
+        """Part number of node"""
+
+        return self.pns[self.pn_codes[node]]
+
+    def key(self, node: int, tuple_keys: bool = False):
+        """Key of node as used in the dictionary tree, (idx, pn) if tuple_keys else 'idx pn'"""
+
+        if tuple_keys:
+            return int(self.labels[node]), self.pn(node)
+        return f'{self.labels[node]} {self.pn(node)}'
+
+    def keys(self, tuple_keys: bool = False):
+        """Keys of all nodes as a list, see key"""
+
+        pns = [self.pns[code] for code in self.pn_codes.tolist()]
+        if tuple_keys:
+            return list(zip(self.labels.astype(int).tolist(), pns))
+        return [f'{label} {pn}' for label, pn in zip(self.labels.tolist(), pns)]
+
+    def to_dict(self, tuple_keys: bool = False, keys: list = None):
+        """Converts to the nested dictionary returned by Parent.build_tree
+
+        :param tuple_keys: use (idx, pn) tuples as keys instead of 'idx pn' strings
+        :param keys: keys from self.keys(tuple_keys), given when converting the same tree more than once
+        """
+        nodes = {}
+        if keys is None:
+            keys = self.keys(tuple_keys)
+        child_ptr, child_ids = self.child_ptr.tolist(), self.child_ids.tolist()
+        # Children always have a higher level than their parent, so build from the lowest level up
+        parents = np.flatnonzero(np.diff(self.child_ptr))
+        parents = parents[np.lexsort((-parents, -self.level[parents]))]
+        for node in parents.tolist():
+            nodes[node] = {keys[child]: nodes.get(child, {})
+                           for child in child_ids[child_ptr[node]:child_ptr[node + 1]]}
+        return {keys[root]: nodes.get(root, {}) for root in self.roots.tolist()}
+
+    def to_flat(self):
+        """Converts to the flat dictionary of Parent.build_flat, every parent with its children"""
+
+        keys = self.keys()
+        child_ptr, child_ids = self.child_ptr.tolist(), self.child_ids.tolist()
+        lowest = np.nanmax(self.level) if len(self.level) else 0
+        nodes = np.concatenate([self.roots, self.child_ids])
+        parents = nodes[self.level[nodes] < lowest]
+        parents = parents[np.lexsort((parents, self.level[parents]))]
+        return {keys[node]: {keys[child]: {} for child in child_ids[child_ptr[node]:child_ptr[node + 1]]}
+                for node in parents.tolist()}
+
+    def to_bytes(self):
+        """Binary encoding of the tree (numpy npz)"""
+
+        buffer = io.BytesIO()
+        arrays = {name: np.asarray(getattr(self, name)) for name in self.ARRAYS}
+        arrays['pns'] = np.array(self.pns, dtype=str)
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        """Reads a tree saved with to_bytes"""
+
+        arrays = np.load(io.BytesIO(data), allow_pickle=False)
+        tree = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(tree, name, arrays[name])
+        tree.labels = pd.Index(tree.labels)
+        tree.pns = [sys.intern(pn) for pn in tree.pns.tolist()]
+        return tree
+
+
+def frame_to_bytes(df: pd.DataFrame):
+    """Binary encoding of a dataframe (numpy npz) that is read back without pickle, see frame_from_bytes
+
+    Note:
+        Number and bool columns are saved as arrays. Other columns can mix ints and strings (see
+        Parser.filter) so their values are saved as json, which keeps the types apart.
+    """
+    meta = {'columns': df.columns.tolist(), 'index_name': df.index.name, 'dtypes': [], 'json': {}}
+    arrays = {}
+    # The index is saved as the first column
+    for position, values in enumerate([df.index.to_series()] + [df.iloc[:, i] for i in range(df.shape[1])]):
+        meta['dtypes'].append(str(values.dtype))
+        if isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf':
+            arrays[f'column{position}'] = values.to_numpy()
+        else:
+            meta['json'][position] = values.tolist()
+    meta = json.dumps(meta, default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+    arrays['meta'] = np.frombuffer(meta.encode(), dtype=np.uint8)
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def frame_from_bytes(data: bytes):
+    """Reads a dataframe saved with frame_to_bytes"""
+
+    arrays = np.load(io.BytesIO(data), allow_pickle=False)
+    meta = json.loads(arrays['meta'].tobytes().decode())
+    series = []
+    for position, dtype in enumerate(meta['dtypes']):
+        if str(position) in meta['json']:
+            values = pd.Series(meta['json'][str(position)], dtype=object)
+            if dtype != 'object':
+                values = values.astype(dtype)
+        else:
+            values = pd.Series(arrays[f'column{position}'])
+        series.append(values)
+    df = pd.DataFrame(dict(enumerate(series[1:])), index=pd.RangeIndex(len(series[0])))
+    df.columns = meta['columns']
+    df.index = pd.Index(series[0], name=meta['index_name'])
+    return df
+
+
+def BuildPackage(save_path: os.path, word_doc: os.path, avl_bom: os.path, compact: bool = False):
     """Builds the CCL package using Parser and Parent classes
 
+    Note:
+        Every file is written directly into the zip, no temporary folder is used. The default
+        package contains ccl.docx, filter.csv, bom.csv, flat.json and tree.json. The compact package
+        contains ccl.docx, filter.npz, bom.npz (see frame_to_bytes) and tree.npz (CompactTree) which
+        are much faster to load. Neither format is pickled so packages from others are safe to read.
+        Use ReadPackage to load either format.
+
     Parameters:
         :param save_path: the path/ location of where to save the CCL package
         :param word_doc: path/ location of where the CCL is saved (docx)
         :param avl_bom: path/ location of where the AVL multi level bom is saved (csv)
+        :param compact: save the compact package instead of csv and json
 
     :return a zip file at the location of the save path
     """
@@ -277,26 +1050,57 @@ def BuildPackage(save_path: os.path, word_doc: os.path, avl_bom: os.path):
     parse = Parser(word_doc)
 
     try:
-        # Create a temporary folder where all files are waiting to be zipped
-        # Temporary folder is created in the cwd
-        os.makedirs('temp')
-        parse.filter().to_csv(os.path.join('temp', 'filter.csv'))
-        parse.document.save(os.path.join('temp', 'ccl.docx'))
-        parent.bom.to_csv(os.path.join('temp', 'bom.csv'))
-        with open(os.path.join('temp', 'flat.json'), 'w') as write:
-            json.dump(parent.build_flat(), write, indent=4)
-        with open(os.path.join('temp', 'tree.json'), 'w') as write:
-            json.dump(parent.build_tree(), write, indent=4)
-        # Zip the folder with all its contents
         with ZipFile(save_path, 'w') as package:
-            files = os.listdir('temp')
-            for file in files:
-                package.write(os.path.join('temp', file), file)
+            if isinstance(word_doc, (str, os.PathLike)):
+                package.write(word_doc, 'ccl.docx')
+            else:
+                with io.BytesIO() as docx:
+                    parse.document.save(docx)
+                    package.writestr('ccl.docx', docx.getvalue())
+            package.writestr('manifest.json', json.dumps({'format': 'compact' if compact else 'csv'}))
+            if compact:
+                package.writestr('filter.npz', frame_to_bytes(parse.filter()))
+                package.writestr('bom.npz', frame_to_bytes(parent.bom))
+                package.writestr('tree.npz', parent.build_compact().to_bytes())
+            else:
+                package.writestr('filter.csv', parse.filter().to_csv())
+                package.writestr('bom.csv', parent.bom.to_csv())
+                # build_tree also builds the flat dictionary
+                tree = parent.build_tree()
+                package.writestr('flat.json', json.dumps(parent.flat, indent=4))
+                package.writestr('tree.json', json.dumps(tree, indent=4))
     except Exception as e:
+        # Remove the partly written package
+        if os.path.exists(save_path):
+            os.remove(save_path)
         raise e
-    finally:
-        # Remove the temporary folder
-        shutil.rmtree('temp')
+
+
+def ReadPackage(path: os.path):
+    """Reads a CCL package made by BuildPackage
+
+    :param path: path/ location of the CCL package
+    :return dictionary with the ccl (docx bytes), filter, bom, flat and tree. Compact packages also
+            include the CompactTree as compact
+    """
+    with ZipFile(path) as package:
+        names = package.namelist()
+        output = {'ccl': package.read('ccl.docx')}
+        if 'tree.npz' in names:
+            output['filter'] = frame_from_bytes(package.read('filter.npz'))
+            output['bom'] = frame_from_bytes(package.read('bom.npz'))
+            compact = CompactTree.from_bytes(package.read('tree.npz'))
+            output['compact'] = compact
+            output['flat'] = compact.to_flat()
+            output['tree'] = compact.to_dict()
+        else:
+            with package.open('filter.csv') as read:
+                output['filter'] = pd.read_csv(read, index_col=0)
+            with package.open('bom.csv') as read:
+                output['bom'] = pd.read_csv(read, index_col=0)
+            output['flat'] = json.loads(package.read('flat.json'))
+            output['tree'] = json.loads(package.read('tree.json'))
+    return output
 
 
 if __name__ == '__main__':